@@ -0,0 +1,124 @@
+from dbg import DBG
+from utils import read_data, n50, ng50, l50, add_graph_arguments, graph_options
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import zipfile
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def unpack(data_dir, name):
+    # extract <name>.zip next to itself unless it was already extracted
+    path = os.path.join(data_dir, name)
+    if not os.path.isdir(path):
+        with zipfile.ZipFile(path + '.zip') as z:
+            z.extractall(data_dir)
+    return path
+
+
+def bench_dataset(path, k, num_contigs, options, genome_size=None):
+    # runs in a fresh process so ru_maxrss is the peak of this dataset alone
+    times = {'parse': 0.0, 'build': 0.0, 'depth': 0.0, 'concat': 0.0, 'delete': 0.0, 'output': 0.0}
+    start = time.perf_counter()
+    short1, short2, long1 = read_data(path)
+    times['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # profiling splits get_longest_contig into its depth, concat and delete
+    # phases, see DBGStats.timers
+    dbg = DBG(k=k, data_list=[short1, short2, long1], profile=True, **options)
+    times['build'] = time.perf_counter() - start
+
+    contigs = []
+    for _ in range(num_contigs):
+        c = dbg.get_longest_contig()
+        if c is None:
+            break
+        contigs.append(c)
+    for phase in ('depth', 'concat', 'delete'):
+        times[phase] = dbg.stats.timers.get(phase, 0.0)
+
+    # the output phase writes to devnull: the dataset directory keeps the
+    # contig.fasta of a real run and the disk adds no noise to the timing
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as f:
+        for i, c in enumerate(contigs):
+            f.write('>contig_%d\n' % i)
+            f.write(c + '\n')
+    times['output'] = time.perf_counter() - start
+    times['total'] = sum(times.values())
+
+    lengths = [len(c) for c in contigs]
+    return {
+        'contigs': len(lengths),
+        'bases': sum(lengths),
+        'lengths': lengths,
+        'n50': n50(lengths),
+        'ng50': ng50(lengths, genome_size) if genome_size else None,
+        'l50': l50(lengths),
+        'seconds': times,
+        'graph': dbg.stats.as_dict(),
+        # kilobytes on linux, bytes on macos
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run(datasets, data_dir=DATA_DIR, k=25, num_contigs=20, options=None, genome_size=None):
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'k': k,
+        'options': options or {},
+        'datasets': {},
+    }
+    print('Dataset\tRuntime\tN50\tL50\tpeak RSS')
+    for name in datasets:
+        path = unpack(data_dir, name)
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            try:
+                result = pool.submit(bench_dataset, path, k, num_contigs, options or {},
+                                     genome_size).result()
+            except BrokenProcessPool:
+                # the worker died, most likely killed for running out of memory
+                result = {'error': 'worker process died'}
+        report['datasets'][name] = result
+        if 'error' in result:
+            print('%s\t%s' % (name, result['error']))
+        else:
+            print('%s\t%.3fs\t%d\t%d\t%d' % (name, result['seconds']['total'], result['n50'],
+                                           result['l50'], result['peak_rss']))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='time the assembler on the week1 datasets')
+    parser.add_argument('datasets', nargs='*', default=['data1', 'data2', 'data3', 'data4'])
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory holding dataN.zip')
+    parser.add_argument('-k', type=int, default=25)
+    parser.add_argument('--contigs', type=int, default=20)
+    parser.add_argument('--genome-size', type=int, default=None, help='reference length for NG50')
+    parser.add_argument('-o', '--output', default='bench.json', help='JSON report to write')
+    add_graph_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args.datasets, args.data_dir, args.k, args.contigs, graph_options(args),
+                 args.genome_size)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
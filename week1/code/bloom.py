@@ -0,0 +1,42 @@
+import math
+
+
+class BloomFilter:
+    # bit-array set of packed k-mers sized for `capacity` keys at `fp_rate`.
+    # DBG uses it to hold k-mers seen once until they come round again.
+    def __init__(self, capacity, fp_rate=0.01):
+        self.size = max(64, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        # keys added that were not already (apparently) present
+        self.count = 0
+
+    def _positions(self, key):
+        # double hashing: hashes bit positions from two independent hashes
+        h1 = hash((key, 0x9E3779B9)) % self.size
+        h2 = hash((0x85EBCA6B, key)) % self.size or 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        # set the key's bits; True if they were all set already, i.e. the key
+        # was (probably) added before
+        bits = self.bits
+        seen = True
+        for pos in self._positions(key):
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                seen = False
+        if not seen:
+            self.count += 1
+        return seen
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def fill_ratio(self):
+        return int.from_bytes(self.bits, 'little').bit_count() / self.size
+
+    def estimated_fp_rate(self):
+        # chance that a new key finds all its bits set, from the actual fill
+        return self.fill_ratio() ** self.hashes
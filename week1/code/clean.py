@@ -0,0 +1,83 @@
+# graph cleaning for the DBG node dict (idx -> Node), run after the build and
+# before contig extraction. lengths are measured in k-mers (node.length), so
+# the same passes also work on a compacted unitig graph.
+
+
+def get_parents(nodes):
+    parents = {idx: [] for idx in nodes}
+    for idx in nodes:
+        for child in nodes[idx].get_children():
+            parents[child].append(idx)
+    return parents
+
+
+def _walk(nodes, parents, idx, forward, max_length):
+    # follow the non-branching chain starting at idx (through children if
+    # forward, else through parents) for up to max_length k-mers. returns the
+    # chain and the branching node it ran into, or None for the anchor if it
+    # stopped at a dead end or got too long.
+    step = (lambda i: nodes[i].get_children()) if forward else (lambda i: parents[i])
+    back = (lambda i: parents[i]) if forward else (lambda i: nodes[i].get_children())
+    chain, length = [idx], nodes[idx].length
+    while True:
+        nxt = step(chain[-1])
+        if len(nxt) != 1:
+            return chain, None
+        nxt = nxt[0]
+        if nxt in chain:
+            return chain, None
+        if len(back(nxt)) != 1:
+            return chain, nxt
+        length += nodes[nxt].length
+        if length > max_length:
+            return chain, None
+        chain.append(nxt)
+
+
+def _coverage(nodes, chain):
+    return sum(nodes[idx].get_count() for idx in chain) / len(chain)
+
+
+def clip_tips(nodes, parents, max_length, max_coverage=None):
+    # a tip is a dead-end chain of at most max_length k-mers hanging off a
+    # branching node. returns the ids to remove.
+    tips = set()
+    for idx in nodes:
+        if parents[idx] and nodes[idx].get_children():
+            continue
+        # a source walks forward into the graph, a sink walks backward
+        forward = not parents[idx]
+        chain, anchor = _walk(nodes, parents, idx, forward, max_length)
+        if anchor is None:
+            continue
+        if max_coverage is not None and _coverage(nodes, chain) > max_coverage:
+            continue
+        tips.update(chain)
+    return tips
+
+
+def pop_bubbles(nodes, parents, max_length, max_ratio):
+    # a bubble is two or more chains of at most max_length k-mers that leave
+    # the same node and meet again at the same node. every branch whose mean
+    # count is at most max_ratio of the best one is removed.
+    popped = set()
+    for idx in nodes:
+        children = nodes[idx].get_children()
+        if len(children) < 2:
+            continue
+        ends = {}
+        for child in children:
+            if len(parents[child]) != 1 or child in popped:
+                continue
+            chain, end = _walk(nodes, parents, child, True, max_length)
+            if end is not None:
+                ends.setdefault(end, []).append(chain)
+        for chains in ends.values():
+            if len(chains) < 2:
+                continue
+            coverage = [_coverage(nodes, chain) for chain in chains]
+            best = max(coverage)
+            for chain, cov in zip(chains, coverage):
+                if cov < best and cov <= max_ratio * best:
+                    popped.update(chain)
+    return popped
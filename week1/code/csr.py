@@ -0,0 +1,290 @@
+import contextlib
+import json
+import os
+
+import numpy as np
+
+from kmer import decode_kmer, last_base, kmer_words, to_words, from_words
+
+# bumped whenever the snapshot layout written by CSRGraph.save changes
+SNAPSHOT_FORMAT = 1
+# arrays a snapshot keeps on disk and maps back in read-only
+_SNAPSHOT_ARRAYS = ['ids', 'kmers', 'counts', 'indptr', 'indices', 'lengths', 'tails', 'tail_offsets',
+                    'guide_pos']
+
+
+class CSRGraph:
+    # array-backed version of the DBG node table. node i keeps its packed
+    # k-mer, count and traversal state at index i, and its children (already
+    # in _get_sorted_children order) at indices[indptr[i]:indptr[i + 1]].
+    # deleted nodes are only tombstoned in `alive`, so the child lists never
+    # have to be rewritten.
+    def __init__(self, k, kmers, counts, indptr, indices, incremental=False,
+                 lengths=None, tails=None, tail_offsets=None, ids=None, guide_pos=None):
+        self.k = k
+        # unitig graphs (DBG.compact) weight each node by its k-mer count and
+        # keep the extra bases per node, as one byte string cut up by
+        # tail_offsets; plain graphs leave these as None
+        self.lengths = lengths
+        self.tails = tails
+        self.tail_offsets = tail_offsets
+        # slot in indices of the child the long-read guide picks for each
+        # node (DBG.guide), -1 for none; None if the graph has no guide
+        self.guide_pos = guide_pos
+        # incremental mode keeps depths between contigs and only repairs the
+        # nodes whose best path ran through a deleted node
+        self.incremental = incremental
+        self._depth_ready = False
+        self.parent_indptr = None
+        self.parent_indices = None
+        # nodes given a depth so far, by full passes and by repairs
+        self.visits = 0
+        # node i was DBG node ids[i]; k > 32 k-mers take kmer_words(k)
+        # columns of uint64, see to_words
+        self.ids = ids
+        self.kmers = kmers
+        self.counts = counts
+        self.indptr = indptr
+        self.indices = indices
+        n = len(counts)
+        self.alive = np.ones(n, dtype=bool)
+        self.visited = np.zeros(n, dtype=bool)
+        self.depth = np.zeros(n, dtype=np.int64)
+        self.max_depth_child = np.full(n, -1, dtype=np.int64)
+
+    @classmethod
+    def from_nodes(cls, nodes, k, incremental=False, guide=None):
+        # node ids are renumbered 0..n-1 in dict order, which is the order the
+        # dict backend visits them in
+        pos = {idx: i for i, idx in enumerate(nodes)}
+        node_id = list(nodes)
+        n = len(pos)
+        if k <= 32:
+            kmers = np.empty(n, dtype=np.uint64)
+        else:
+            kmers = np.empty((n, kmer_words(k)), dtype=np.uint64)
+        counts = np.empty(n, dtype=np.int64)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indices = []
+        lengths = np.ones(n, dtype=np.int64)
+        tails = [''] * n
+        guide_pos = np.full(n, -1, dtype=np.int64) if guide else None
+        for i, node in enumerate(nodes.values()):
+            kmers[i] = node.kmer if k <= 32 else to_words(node.kmer, k)
+            counts[i] = node.get_count()
+            lengths[i] = node.length
+            tails[i] = node.tail
+            children = node.get_children()
+            children.sort(key=lambda child: nodes[child].get_count(), reverse=True)
+            if guide_pos is not None and guide.get(node_id[i]) in children:
+                guide_pos[i] = len(indices) + children.index(guide[node_id[i]])
+            indices.extend(pos[child] for child in children)
+            indptr[i + 1] = len(indices)
+        tail_offsets = None
+        if (lengths == 1).all():
+            lengths, tails = None, None
+        else:
+            tail_offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum([len(tail) for tail in tails], out=tail_offsets[1:])
+            tails = np.frombuffer(''.join(tails).encode('ascii'), dtype=np.uint8)
+        return cls(k, kmers, counts, indptr, np.array(indices, dtype=np.int64),
+                   incremental=incremental, lengths=lengths, tails=tails,
+                   tail_offsets=tail_offsets, ids=np.array(node_id, dtype=np.int64),
+                   guide_pos=guide_pos)
+
+    def save(self, path, **meta):
+        # snapshot as a directory of .npy files plus graph.json, so load() can
+        # map the arrays back without parsing anything. meta is stored as is
+        # for the caller (DBG.save keeps its own settings there).
+        os.makedirs(path, exist_ok=True)
+        for name in _SNAPSHOT_ARRAYS + ['alive']:
+            array = getattr(self, name)
+            if array is not None:
+                np.save(os.path.join(path, name + '.npy'), array)
+        header = {'format': SNAPSHOT_FORMAT, 'k': self.k, 'nodes': len(self.counts), 'meta': meta}
+        with open(os.path.join(path, 'graph.json'), 'w') as f:
+            json.dump(header, f, indent=1)
+
+    @classmethod
+    def load(cls, path, incremental=False, mmap_mode='r'):
+        # returns (graph, meta). the graph arrays stay memory-mapped read-only,
+        # so processes loading the same snapshot share the pages; only the
+        # traversal state (alive, depth, ...) is private to each process
+        with open(os.path.join(path, 'graph.json')) as f:
+            header = json.load(f)
+        if header['format'] != SNAPSHOT_FORMAT:
+            raise ValueError("unsupported snapshot format %r in %s" % (header['format'], path))
+        arrays = {}
+        for name in _SNAPSHOT_ARRAYS:
+            filename = os.path.join(path, name + '.npy')
+            arrays[name] = np.load(filename, mmap_mode=mmap_mode) if os.path.exists(filename) else None
+        graph = cls(header['k'], incremental=incremental, **arrays)
+        graph.alive[:] = np.load(os.path.join(path, 'alive.npy'))
+        return graph, header['meta']
+
+    def get_kmer(self, i):
+        # packed k-mer of node i as a python int
+        if self.kmers.ndim == 1:
+            return int(self.kmers[i])
+        return from_words(self.kmers[i])
+
+    def get_tail(self, i):
+        if self.tails is None:
+            return ''
+        return self.tails[self.tail_offsets[i]:self.tail_offsets[i + 1]].tobytes().decode('ascii')
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def reset(self):
+        self.visited.fill(False)
+        self.depth.fill(0)
+        self.max_depth_child.fill(-1)
+
+    def get_depth(self, idx):
+        # same explicit-stack post-order walk as DBG._get_depth, reading the
+        # arrays through memoryviews to avoid numpy scalar boxing
+        indptr, indices = memoryview(self.indptr), memoryview(self.indices)
+        alive, visited = memoryview(self.alive), memoryview(self.visited)
+        depth, max_child = memoryview(self.depth), memoryview(self.max_depth_child)
+        lengths = None if self.lengths is None else memoryview(self.lengths)
+        guide = None if self.guide_pos is None else memoryview(self.guide_pos)
+        if visited[idx]:
+            return depth[idx]
+        visited[idx] = True
+
+        def guided(i):
+            # a guided node only walks its guide slot while that child is alive
+            g = guide[i]
+            if g >= 0 and alive[indices[g]]:
+                return [i, g, g + 1, 0, -1]
+            return [i, indptr[i], indptr[i + 1], 0, -1]
+
+        # frame: [idx, next child slot, end slot, max depth, max child]
+        stack = [[idx, indptr[idx], indptr[idx + 1], 0, -1] if guide is None else guided(idx)]
+        while stack:
+            frame = stack[-1]
+            if frame[1] < frame[2]:
+                child = indices[frame[1]]
+                frame[1] += 1
+                if not alive[child]:
+                    continue
+                if not visited[child]:
+                    visited[child] = True
+                    if guide is None:
+                        stack.append([child, indptr[child], indptr[child + 1], 0, -1])
+                    else:
+                        stack.append(guided(child))
+                    continue
+                d = depth[child]
+                if d > frame[3]:
+                    frame[3], frame[4] = d, child
+            else:
+                stack.pop()
+                node = frame[0]
+                d = frame[3] + (1 if lengths is None else lengths[node])
+                depth[node], max_child[node] = d, frame[4]
+                if stack:
+                    parent = stack[-1]
+                    if d > parent[3]:
+                        parent[3], parent[4] = d, node
+        return depth[idx]
+
+    def _build_parents(self):
+        # reverse CSR: parents of node i at parent_indices[parent_indptr[i]:...]
+        n = len(self.counts)
+        src = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        self.parent_indices = src[order]
+        self.parent_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n), out=self.parent_indptr[1:])
+
+    def _repair(self, path):
+        # after deleting path, only nodes whose max_depth_child chain reached
+        # a deleted node can have a different depth or best child; every other
+        # node still has the same first-maximum child since depths only drop
+        if self.parent_indptr is None:
+            self._build_parents()
+        parent_indptr = memoryview(self.parent_indptr)
+        parent_indices = memoryview(self.parent_indices)
+        alive, visited = memoryview(self.alive), memoryview(self.visited)
+        depth, max_child = memoryview(self.depth), memoryview(self.max_depth_child)
+        stale = []
+        queue = list(path)
+        while queue:
+            idx = queue.pop()
+            for j in range(parent_indptr[idx], parent_indptr[idx + 1]):
+                parent = parent_indices[j]
+                if alive[parent] and visited[parent] and max_child[parent] == idx:
+                    visited[parent] = False
+                    depth[parent], max_child[parent] = 0, -1
+                    stale.append(parent)
+                    queue.append(parent)
+        stale.sort()
+        self.visits += len(stale)
+        for idx in stale:
+            if not visited[idx]:
+                self.get_depth(idx)
+        return len(stale)
+
+    def get_longest_path(self):
+        alive, visited = memoryview(self.alive), memoryview(self.visited)
+        if not (self.incremental and self._depth_ready):
+            self.visits += len(self)
+            for idx in range(len(self.counts)):
+                if alive[idx] and not visited[idx]:
+                    self.get_depth(idx)
+            self._depth_ready = True
+        if not self.alive.any():
+            return []
+        # first node with the largest depth, like the dict backend's scan
+        idx = int(np.argmax(np.where(self.alive, self.depth, 0)))
+        path = []
+        max_child = memoryview(self.max_depth_child)
+        while idx != -1:
+            path.append(idx)
+            idx = max_child[idx]
+        return path
+
+    def delete_path(self, path):
+        # O(len(path)): children lists keep the ids and skip tombstones
+        self.alive[path] = False
+
+    def concat_path(self, path):
+        if len(path) < 1:
+            return None
+        concat = [decode_kmer(self.get_kmer(path[0]), self.k), self.get_tail(path[0])]
+        for idx in path[1:]:
+            concat.append(last_base(self.get_kmer(idx)))
+            concat.append(self.get_tail(idx))
+        return ''.join(concat)
+
+    def count_histogram(self):
+        return np.bincount(self.counts[self.alive]).tolist()
+
+    def filter_counts(self, min_count):
+        # tombstone every node with count < min_count, like delete_path
+        weak = self.alive & (self.counts < min_count)
+        self.alive[weak] = False
+        self._depth_ready = False
+        return int(weak.sum())
+
+    def get_longest_contig(self, timer=None):
+        # timer(name) is a context manager timing each phase (see
+        # DBGStats.timer); an incremental repair counts as deletion
+        timer = timer or _no_timer
+        with timer('depth'):
+            if not self.incremental:
+                self.reset()
+            path = self.get_longest_path()
+        with timer('concat'):
+            contig = self.concat_path(path)
+        with timer('delete'):
+            self.delete_path(path)
+            if self.incremental:
+                self._repair(path)
+        return contig
+
+
+def _no_timer(name):
+    return contextlib.nullcontext()
@@ -1,18 +1,33 @@
-import copy
 # from matplotlib import pyplot as plt
+import contextlib
+import gc
+import multiprocessing
+import time
 
+import numpy as np
 
-def reverse_complement(key):
-    complement = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G'}
+from bloom import BloomFilter
+from clean import get_parents, clip_tips, pop_bubbles
+from kmer import (encode_read_both, encode_reads, split_ambiguous, decode_kmer, last_base,
+                  reverse_complement)
+from stats import DBGStats
 
-    key = list(key[::-1])
-    for i in range(len(key)):
-        key[i] = complement[key[i]]
-    return ''.join(key)
+# reads per work unit for the parallel build
+SHARD_SIZE = 5000
+# reads encoded together by kmer.encode_reads in the serial build
+ENCODE_BATCH = 64
+# long-read traversals of an arc needed before the guide follows it
+GUIDE_MIN_VOTES = 2
 
 
 class Node:
+    __slots__ = ('_children', '_count', 'kmer', 'visited', 'depth', 'max_depth_child')
+    # a plain node is a single k-mer; see Unitig
+    length = 1
+    tail = ''
+
     def __init__(self, kmer):
+        # kmer is the 2-bit packed code, see kmer.py
         self._children = set()
         self._count = 0
         self.kmer = kmer
@@ -23,8 +38,8 @@ class Node:
     def add_child(self, kmer):
         self._children.add(kmer)
 
-    def increase(self):
-        self._count += 1
+    def increase(self, n=1):
+        self._count += n
 
     def reset(self):
         self.visited = False
@@ -41,38 +56,416 @@ class Node:
         self._children = self._children - target
 
 
+class Unitig(Node):
+    # a maximal non-branching run of k-mers collapsed into one node: kmer is
+    # the first k-mer, tail the bases the others add, length the k-mer count
+    __slots__ = ('length', 'tail')
+
+    def __init__(self, kmer, tail):
+        Node.__init__(self, kmer)
+        self.tail = tail
+        self.length = len(tail) + 1
+
+
 class DBG:
-    def __init__(self, k, data_list):
+    def __init__(self, k, data_list, backend='dict', incremental=False, workers=1,
+                 min_count=None, clean=False, compact=False, profile=False,
+                 guide_length=None, bloom_capacity=None, bloom_fp_rate=0.01):
+        self._setup(k, workers, profile)
+        # reads at least guide_length long also vote for the arcs they take,
+        # see _finish_guide; None builds no guide
+        self.guide_length = guide_length
+        # with a bloom_capacity (expected distinct k-mers), k-mers seen once
+        # only go into a Bloom filter and become nodes on their next sighting
+        if bloom_capacity is not None:
+            if workers > 1:
+                raise ValueError("the Bloom-filtered build needs workers=1")
+            self.bloom = BloomFilter(bloom_capacity, bloom_fp_rate)
+        # build
+        self._check(data_list)
+        with self._phase('build'):
+            self._build(data_list)
+        self._finish(min_count, clean, compact, backend, incremental)
+
+    def _finish(self, min_count, clean, compact, backend, incremental):
+        # the passes between the Node dict and contig extraction, run on a
+        # freshly built graph or on one thawed from a snapshot.
+        # drop k-mers seen fewer than min_count times ('auto' picks the
+        # histogram valley); None keeps every k-mer
+        if min_count is not None:
+            with self._phase('filter'):
+                self.filter_solid(min_count)
+        # clean=True runs clean() with its defaults, a dict passes options
+        if clean:
+            with self._phase('clean'):
+                self.clean(**(clean if isinstance(clean, dict) else {}))
+        if compact:
+            with self._phase('compact'):
+                self.compact()
+        if backend == 'csr':
+            with self._phase('freeze'):
+                self._freeze(incremental)
+        elif backend != 'dict':
+            raise ValueError("unknown backend %r" % backend)
+        elif incremental:
+            raise ValueError("incremental contig extraction needs backend='csr'")
+
+    def _setup(self, k, workers, profile=False):
         self.k = k
+        # workers > 1 counts shards of reads in a process pool, see _build_parallel
+        self.workers = workers
         self.nodes = {}
         # private
         self.kmer2idx = {}
         self.kmer_count = 0
-        # build
-        self._check(data_list)
-        self._build(data_list)
+        # array backend, see csr.py; None while using the Node dict
+        self.graph = None
+        # settings of filter_solid and clean, once they have run
+        self.min_count = None
+        self.clean_report = []
+        # counters and timers (see stats.py), only kept with profile=True
+        self.stats = DBGStats() if profile else None
+        # long-read threading index: node id -> the child long reads follow
+        self.guide_length = None
+        self.guide = {}
+        self._guide_votes = {}
+        # Bloom filter of the gated build, dropped once the build is done and
+        # its estimated false-positive rate kept
+        self.bloom = None
+        self.bloom_fp_estimate = None
+        # k-mer windows skipped because they spanned an N or other non-ACGT base
+        self.skipped_kmers = 0
+
+    def _phase(self, name):
+        # times a construction phase into stats, if profiling
+        if self.stats is None:
+            return contextlib.nullcontext()
+        return self.stats.timer(name)
+
+    def save(self, path):
+        # write the graph to a snapshot directory (see CSRGraph.save) that
+        # DBG.load can map back in instead of rebuilding from the reads. works
+        # from either backend; contigs already taken stay deleted.
+        from csr import CSRGraph
+        graph = self.graph
+        if graph is None:
+            graph = CSRGraph.from_nodes(self.nodes, self.k, guide=self.guide)
+        graph.save(path, kmer_count=self.kmer_count, min_count=self.min_count,
+                   clean_report=self.clean_report)
+
+    @classmethod
+    def load(cls, path, backend='csr', incremental=False, min_count=None, clean=False,
+             compact=False, profile=False):
+        # reload a snapshot written by save. backend='csr' keeps the arrays
+        # memory-mapped, so it costs about nothing whatever the graph size;
+        # backend='dict' rebuilds the Node dict under the original node ids.
+        # min_count, clean and compact run as in DBG() on the Node dict, so
+        # with any of them a csr graph is thawed and frozen again.
+        from csr import CSRGraph
+        graph, meta = CSRGraph.load(path, incremental)
+        dbg = cls.__new__(cls)
+        dbg._setup(graph.k, 1, profile)
+        dbg.kmer_count = meta['kmer_count']
+        dbg.min_count = meta['min_count']
+        dbg.clean_report = meta['clean_report']
+        if backend == 'csr' and min_count is None and not clean and not compact:
+            dbg.graph = graph
+        else:
+            dbg._thaw(graph)
+            dbg._finish(min_count, clean, compact, backend, incremental)
+        return dbg
+
+    def _thaw(self, graph):
+        # inverse of _freeze: Node dict from the arrays, skipping tombstones
+        ids = graph.ids.tolist()
+        alive = graph.alive.tolist()
+        counts = graph.counts.tolist()
+        indptr, indices = graph.indptr.tolist(), graph.indices.tolist()
+        for i, idx in enumerate(ids):
+            if not alive[i]:
+                continue
+            kmer = graph.get_kmer(i)
+            node = Node(kmer) if graph.lengths is None else Unitig(kmer, graph.get_tail(i))
+            node.increase(counts[i])
+            node._children = set(ids[j] for j in indices[indptr[i]:indptr[i + 1]] if alive[j])
+            self.nodes[idx] = node
+            if graph.guide_pos is not None and graph.guide_pos[i] >= 0:
+                self.guide[idx] = ids[indices[graph.guide_pos[i]]]
+            # a compacted graph has no k-mer index, see compact()
+            if graph.lengths is None:
+                self.kmer2idx[kmer] = idx
 
     def _check(self, data_list):
-        # check data list
+        # check data list; the sources may be lazy iterators (utils.stream_data)
+        # so reads are not inspected here, reads shorter than k add no arcs
         assert len(data_list) > 0
-        assert self.k <= len(data_list[0][0])
+        assert self.k > 0
 
     def _build(self, data_list):
-        for data in data_list:
-            for original in data:
-                rc = reverse_complement(original)
-                for i in range(len(original) - self.k - 1):
-                    self._add_arc(original[i: i + self.k], original[i + 1: i + 1 + self.k])
-                    self._add_arc(rc[i: i + self.k], rc[i + 1: i + 1 + self.k])
+        if self.stats is not None:
+            data_list = [self.stats.count_reads(data, self.k) for data in data_list]
+        if self.workers > 1:
+            self._build_parallel(data_list)
+        else:
+            for batch in _iter_shards(data_list, ENCODE_BATCH):
+                self._add_reads(batch)
+        self._finish_guide()
+        if self.bloom is not None:
+            self.bloom_fp_estimate = self.bloom.estimated_fp_rate()
+            self.bloom = None
+        if self.stats is not None:
+            # nothing is deleted while building, so the graph size is what
+            # was created
+            self.stats.nodes_created = len(self.nodes)
+            self.stats.arcs_created = sum(len(node._children) for node in self.nodes.values())
+            self.stats.skipped_kmers = self.skipped_kmers
+            # encode_reads gives every window it keeps its reverse complement
+            # code, and it keeps every window not cut at an ambiguous base
+            self.stats.rc_calls = self.stats.kmer_windows - self.skipped_kmers
 
-    def show_count_distribution(self):
-        count = [0] * 30
+    def _add_reads(self, reads):
+        # encode the whole batch in one vectorized pass, then add each read.
+        # reads with ambiguous bases are added as their ACGT-only pieces.
+        reads, skipped = split_ambiguous(reads, self.k)
+        self.skipped_kmers += skipped
+        for original, codes in zip(reads, encode_reads(reads, self.k)):
+            self._add_read(original, codes)
+
+    def _add_read(self, original, codes=None):
+        # codes are the (forward, reverse complement) window codes from
+        # encode_read_both, if the caller already has them
+        if codes is None:
+            codes = encode_read_both(original, self.k)
+        if self.bloom is not None:
+            self._add_read_gated(original, codes)
+            return
+        # the windows of reverse_complement(original), left to right
+        fwd, rev = codes[0], codes[1][::-1]
+        if self._is_guide_read(original):
+            votes = self._guide_votes
+            for i in range(len(original) - self.k - 1):
+                for arc in (self._add_arc(fwd[i], fwd[i + 1]), self._add_arc(rev[i], rev[i + 1])):
+                    votes[arc] = votes.get(arc, 0) + 1
+            return
+        for i in range(len(original) - self.k - 1):
+            self._add_arc(fwd[i], fwd[i + 1])
+            self._add_arc(rev[i], rev[i + 1])
+
+    def _add_read_gated(self, original, codes):
+        # _add_read for the Bloom-filtered build: a window only gets a node
+        # once its k-mer was seen before (already a node, or in the filter),
+        # and only arcs between two such windows are added. counts therefore
+        # leave out the sighting that only went into the filter.
+        votes = self._guide_votes if self._is_guide_read(original) else None
+        fwd, rev = codes[0], codes[1][::-1]
+        n = len(original) - self.k - 1
+        seen_fwd = [self._seen(code) for code in fwd[:n + 1]]
+        seen_rev = [self._seen(code) for code in rev[:n + 1]]
+        for i in range(n):
+            for codes, seen in ((fwd, seen_fwd), (rev, seen_rev)):
+                if seen[i] and seen[i + 1]:
+                    arc = self._add_arc(codes[i], codes[i + 1])
+                    if votes is not None:
+                        votes[arc] = votes.get(arc, 0) + 1
+
+    def _seen(self, key):
+        return key in self.kmer2idx or self.bloom.add(key)
+
+    def _is_guide_read(self, original):
+        return self.guide_length is not None and len(original) >= self.guide_length
+
+    def _finish_guide(self):
+        # turn the long-read arc votes into the guide: a branching node gets
+        # an entry when every vote out of it went to one child, at least
+        # GUIDE_MIN_VOTES times. anything else is left to the counts.
+        successors = {}
+        for (idx1, idx2), votes in self._guide_votes.items():
+            successors.setdefault(idx1, []).append((idx2, votes))
+        self._guide_votes = {}
+        for idx, voted in successors.items():
+            if len(voted) == 1 and voted[0][1] >= GUIDE_MIN_VOTES \
+                    and len(self.nodes[idx].get_children()) > 1:
+                self.guide[idx] = voted[0][0]
+
+    def _build_parallel(self, data_list):
+        # shards are counted in worker processes and their tables merged with
+        # numpy (see _merge_tables) before any Node exists. pending tables are
+        # folded into the merged one whenever they outgrow it, so the parent
+        # holds at most about twice the final table at a time.
+        jobs = ((self.k, self.guide_length, shard) for shard in _iter_shards(data_list))
+        tables = []
+        with multiprocessing.Pool(self.workers) as pool:
+            for table in pool.imap(_count_shard, jobs):
+                tables.append(table)
+                if sum(len(t[0]) for t in tables[1:]) > len(tables[0][0]):
+                    tables = [_merge_tables(tables)]
+        if tables:
+            self._add_table(*_merge_tables(tables))
+
+    def _add_table(self, kmers, counts, src, dst, votes, skipped):
+        # fill the still empty graph from a merged shard table, whose local
+        # ids become the node ids. k-mers are in first-seen order and arcs in
+        # first-added order, so node ids, counts and child insertion order
+        # are the same as the serial build's.
+        self.skipped_kmers += skipped
+        kmers = kmers.tolist()
+        self.kmer2idx = dict(zip(kmers, range(len(kmers))))
+        self.kmer_count = len(kmers)
+        # one child set per parent, from the arcs grouped by a stable sort
+        order = np.argsort(src, kind='stable')
+        parents, starts = np.unique(src[order], return_index=True)
+        children = dst[order].tolist()
+        ends = starts[1:].tolist() + [len(children)]
+        # none of these objects form cycles, and leaving the collector on
+        # while they are allocated costs more than creating them
+        with _gc_paused():
+            for idx, (kmer, count) in enumerate(zip(kmers, counts.tolist())):
+                node = self.nodes[idx] = Node(kmer)
+                node.increase(count)
+            for idx, start, end in zip(parents.tolist(), starts.tolist(), ends):
+                self.nodes[idx]._children = set(children[start:end])
+        self._guide_votes = votes
+
+    def _freeze(self, incremental=False):
+        # move the built graph into the array backend and drop the Node dict
+        from csr import CSRGraph
+        self.graph = CSRGraph.from_nodes(self.nodes, self.k, incremental, self.guide)
+        self.nodes = {}
+        self.kmer2idx = {}
+
+    def count_histogram(self):
+        # hist[c] is the number of nodes with count c, over the full range
+        if self.graph is not None:
+            return self.graph.count_histogram()
+        hist = [0]
         for idx in self.nodes:
-            count[self.nodes[idx].get_count()] += 1
+            c = self.nodes[idx].get_count()
+            if c >= len(hist):
+                hist.extend([0] * (c + 1 - len(hist)))
+            hist[c] += 1
+        return hist
+
+    def show_count_distribution(self):
+        count = self.count_histogram()
         print(count[0:10])
         # plt.plot(count)
         # plt.show()
 
+    def filter_solid(self, min_count='auto'):
+        # remove nodes with count < min_count and every arc into them;
+        # returns the number of nodes removed
+        if min_count == 'auto':
+            min_count = find_solid_cutoff(self.count_histogram())
+        self.min_count = min_count
+        if self.graph is not None:
+            return self.graph.filter_counts(min_count)
+        weak = set(idx for idx in self.nodes if self.nodes[idx].get_count() < min_count)
+        self._drop_nodes(weak)
+        return len(weak)
+
+    def clean(self, tip_length=None, tip_coverage=None, bubble_length=None, bubble_ratio=0.5,
+              max_passes=3):
+        # alternate tip clipping and bubble popping (see clean.py) until a
+        # pass removes nothing. lengths are in k-mers and default to 2k.
+        # returns one {'tips': n, 'bubbles': n} report per pass.
+        if self.graph is not None:
+            raise ValueError("clean() runs on the node dict, before backend='csr' freezes it")
+        tip_length = 2 * self.k if tip_length is None else tip_length
+        bubble_length = 2 * self.k if bubble_length is None else bubble_length
+        report = []
+        for _ in range(max_passes):
+            parents = get_parents(self.nodes)
+            tips = clip_tips(self.nodes, parents, tip_length, tip_coverage)
+            self._drop_nodes(tips, parents)
+            parents = get_parents(self.nodes)
+            bubbles = pop_bubbles(self.nodes, parents, bubble_length, bubble_ratio)
+            self._drop_nodes(bubbles, parents)
+            report.append({'tips': len(tips), 'bubbles': len(bubbles)})
+            if not tips and not bubbles:
+                break
+        self.clean_report = report
+        return report
+
+    def _drop_nodes(self, ids, parents=None):
+        # delete nodes and every arc into them; with a parents map only the
+        # affected nodes are touched
+        if not ids:
+            return
+        for idx in ids:
+            node = self.nodes.pop(idx)
+            self.guide.pop(idx, None)
+            self.kmer2idx.pop(node.kmer, None)
+        if parents is None:
+            for idx in self.nodes:
+                self.nodes[idx].remove_children(ids)
+        else:
+            for idx in set(p for i in ids for p in parents[i]) - ids:
+                self.nodes[idx].remove_children(ids)
+
+    def compact(self):
+        # collapse maximal non-branching paths into Unitig nodes. a unitig
+        # keeps the id, count and position of its first k-mer and the
+        # children of its last one, and _get_depth weights it by length, so
+        # depths are still counted in k-mers. returns the new node count.
+        indegree, parent = {}, {}
+        for idx in self.nodes:
+            for child in self.nodes[idx].get_children():
+                indegree[child] = indegree.get(child, 0) + 1
+                parent[child] = idx
+
+        def next_in_run(idx):
+            # the single child idx runs into without a branch, or None
+            children = self.nodes[idx].get_children()
+            if len(children) == 1:
+                child = children[0]
+                if child != idx and indegree[child] == 1:
+                    return child
+            return None
+
+        runs = []
+        seen = set()
+        for idx in self.nodes:
+            if indegree.get(idx, 0) == 1 and next_in_run(parent[idx]) == idx:
+                continue
+            run = [idx]
+            while True:
+                child = next_in_run(run[-1])
+                if child is None:
+                    break
+                run.append(child)
+            seen.update(run)
+            runs.append(run)
+        # what is left are isolated cycles with no branch to start from
+        for idx in self.nodes:
+            if idx not in seen:
+                run = [idx]
+                seen.add(idx)
+                child = next_in_run(idx)
+                while child is not None and child not in seen:
+                    run.append(child)
+                    seen.add(child)
+                    child = next_in_run(child)
+                runs.append(run)
+
+        runs.sort(key=lambda run: run[0])
+        nodes = {}
+        guide = {}
+        for run in runs:
+            first, last = self.nodes[run[0]], self.nodes[run[-1]]
+            unitig = Unitig(first.kmer, ''.join(last_base(self.nodes[idx].kmer) for idx in run[1:]))
+            unitig.increase(first.get_count())
+            unitig._children = last._children
+            nodes[run[0]] = unitig
+            # only the last k-mer of a run can branch, and its children all
+            # start runs, so guide entries just move to the unitig's id
+            if run[-1] in self.guide:
+                guide[run[0]] = self.guide[run[-1]]
+        self.nodes = nodes
+        self.guide = guide
+        # interior k-mers are gone, so the k-mer index no longer applies
+        self.kmer2idx = {}
+        return len(self.nodes)
+
     def _add_node(self, kmer):
         if kmer not in self.kmer2idx:
             self.kmer2idx[kmer] = self.kmer_count
@@ -86,25 +479,54 @@ class DBG:
         idx1 = self._add_node(kmer1)
         idx2 = self._add_node(kmer2)
         self.nodes[idx1].add_child(idx2)
+        return idx1, idx2
 
     def _get_count(self, child):
         return self.nodes[child].get_count()
 
     def _get_sorted_children(self, idx):
         children = self.nodes[idx].get_children()
+        if self.guide:
+            # a guided node only continues along its long-read child while
+            # that child is still in the graph
+            child = self.guide.get(idx)
+            if child is not None and child in children:
+                return [child]
         children.sort(key=self._get_count, reverse=True)
         return children
 
     def _get_depth(self, idx):
-        if not self.nodes[idx].visited:
-            self.nodes[idx].visited = True
-            children = self._get_sorted_children(idx)
-            max_depth, max_child = 0, None
-            for child in children:
-                depth = self._get_depth(child)
-                if depth > max_depth:
-                    max_depth, max_child = depth, child
-            self.nodes[idx].depth, self.nodes[idx].max_depth_child = max_depth + 1, max_child
+        # post-order walk with an explicit stack instead of recursion, so long
+        # graphs don't need a raised recursion limit or a huge C stack.
+        # each frame is [idx, sorted children, next child, max depth, max child]
+        node = self.nodes[idx]
+        if node.visited:
+            return node.depth
+        node.visited = True
+        stack = [[idx, self._get_sorted_children(idx), 0, 0, None]]
+        while stack:
+            frame = stack[-1]
+            children = frame[1]
+            if frame[2] < len(children):
+                child = children[frame[2]]
+                frame[2] += 1
+                child_node = self.nodes[child]
+                if not child_node.visited:
+                    child_node.visited = True
+                    stack.append([child, self._get_sorted_children(child), 0, 0, None])
+                    continue
+                # already finished, or still on the stack (depth 0) for a cycle
+                depth = child_node.depth
+                if depth > frame[3]:
+                    frame[3], frame[4] = depth, child
+            else:
+                stack.pop()
+                node = self.nodes[frame[0]]
+                node.depth, node.max_depth_child = frame[3] + node.length, frame[4]
+                if stack:
+                    parent = stack[-1]
+                    if node.depth > parent[3]:
+                        parent[3], parent[4] = node.depth, frame[0]
         return self.nodes[idx].depth
 
     def _reset(self):
@@ -134,15 +556,157 @@ class DBG:
     def _concat_path(self, path):
         if len(path) < 1:
             return None
-        concat = copy.copy(self.nodes[path[0]].kmer)
+        # k-mers stay packed until here; each later node adds its last base
+        # (plus the rest of the unitig, if compacted)
+        concat = [decode_kmer(self.nodes[path[0]].kmer, self.k), self.nodes[path[0]].tail]
         for i in range(1, len(path)):
-            concat += self.nodes[path[i]].kmer[-1]
-        return concat
+            node = self.nodes[path[i]]
+            concat.append(last_base(node.kmer))
+            concat.append(node.tail)
+        return ''.join(concat)
 
     def get_longest_contig(self):
+        if self.stats is not None:
+            return self._get_longest_contig_profiled()
+        if self.graph is not None:
+            return self.graph.get_longest_contig()
         # reset params in nodes for getting longest path
         self._reset()
         path = self._get_longest_path()
         contig = self._concat_path(path)
         self._delete_path(path)
         return contig
+
+    def _get_longest_contig_profiled(self):
+        # get_longest_contig, recording time, depth visits and deletions, and
+        # adding its depth, concat and delete phases to the stats timers
+        start = time.perf_counter()
+        timer = self.stats.timer
+        if self.graph is None:
+            # every remaining node gets a fresh depth on each pass
+            visits = len(self.nodes)
+            with timer('depth'):
+                self._reset()
+                path = self._get_longest_path()
+            with timer('concat'):
+                contig = self._concat_path(path)
+            with timer('delete'):
+                self._delete_path(path)
+            deleted = len(path)
+        else:
+            before, alive = self.graph.visits, len(self.graph)
+            contig = self.graph.get_longest_contig(timer)
+            visits, deleted = self.graph.visits - before, alive - len(self.graph)
+        self.stats.contig_seconds.append(time.perf_counter() - start)
+        self.stats.depth_visits.append(visits)
+        self.stats.deleted_nodes.append(deleted)
+        return contig
+
+
+def find_solid_cutoff(hist):
+    # first valley of the count histogram: error k-mers fall off from count 1
+    # and true k-mers rise towards the coverage peak. counts go up by 2 for a
+    # k-mer inside a read and by 1 at read ends, so neighbouring buckets are
+    # summed to smooth out the odd/even pattern. 1 (keep everything) if the
+    # histogram has no valley.
+    smooth = [hist[c] + (hist[c + 1] if c + 1 < len(hist) else 0) for c in range(len(hist))]
+    for c in range(1, len(smooth) - 1):
+        if smooth[c] < smooth[c + 1]:
+            return c
+    return 1
+
+
+class _ShardTable(DBG):
+    # the k-mer table of one shard of reads, filled by the same _add_read code
+    # as DBG but kept as flat lists: k-mers and counts by local id, and arcs
+    # in the order they were first added
+    def __init__(self, k, guide_length=None):
+        # all the attributes of a DBG, so the build code shared with it finds
+        # any setting it reads, such as bloom or skipped_kmers
+        self._setup(k, 1)
+        self.guide_length = guide_length
+        self.kmers = []
+        self.counts = []
+        self.arcs = {}
+
+    def _add_node(self, kmer):
+        idx = self.kmer2idx.get(kmer)
+        if idx is None:
+            idx = self.kmer2idx[kmer] = len(self.kmers)
+            self.kmers.append(kmer)
+            self.counts.append(0)
+        self.counts[idx] += 1
+        return idx
+
+    def _add_arc(self, kmer1, kmer2):
+        idx1 = self._add_node(kmer1)
+        idx2 = self._add_node(kmer2)
+        self.arcs[idx1, idx2] = None
+        return idx1, idx2
+
+    def to_arrays(self):
+        kmer_dtype = np.uint64 if self.k <= 32 else object
+        arcs = np.array(list(self.arcs), dtype=np.int64).reshape(-1, 2)
+        return (np.array(self.kmers, dtype=kmer_dtype), np.array(self.counts, dtype=np.int64),
+                arcs[:, 0], arcs[:, 1], self._guide_votes, self.skipped_kmers)
+
+
+def _merge_tables(tables):
+    # several shard tables (see _ShardTable.to_arrays) as one, as if their
+    # reads had been counted in a single shard: k-mers keep their first-seen
+    # order, counts are summed and repeated arcs dropped. all of it is done
+    # on the arrays; only the long-read votes are a dict.
+    if len(tables) == 1:
+        return tables[0]
+    sizes = [len(t[0]) for t in tables]
+    offsets = np.cumsum([0] + sizes)
+    kmers, first, inverse = np.unique(np.concatenate([t[0] for t in tables]),
+                                      return_index=True, return_inverse=True)
+    # renumber the unique k-mers by first sighting
+    order = np.argsort(first)
+    rank = np.empty(len(kmers), dtype=np.int64)
+    rank[order] = np.arange(len(kmers))
+    ids = rank[inverse.ravel()]
+    counts = np.bincount(ids, weights=np.concatenate([t[1] for t in tables]),
+                         minlength=len(kmers)).astype(np.int64)
+    src = np.concatenate([ids[offsets[i] + t[2]] for i, t in enumerate(tables)])
+    dst = np.concatenate([ids[offsets[i] + t[3]] for i, t in enumerate(tables)])
+    _, first_arc = np.unique(src * len(kmers) + dst, return_index=True)
+    first_arc.sort()
+    votes = {}
+    for i, t in enumerate(tables):
+        for (a, b), n in t[4].items():
+            arc = (int(ids[offsets[i] + a]), int(ids[offsets[i] + b]))
+            votes[arc] = votes.get(arc, 0) + n
+    return (kmers[order], counts, src[first_arc], dst[first_arc], votes,
+            sum(t[5] for t in tables))
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _iter_shards(data_list, size=SHARD_SIZE):
+    shard = []
+    for data in data_list:
+        for read in data:
+            shard.append(read)
+            if len(shard) == size:
+                yield shard
+                shard = []
+    if shard:
+        yield shard
+
+
+def _count_shard(job):
+    k, guide_length, reads = job
+    table = _ShardTable(k, guide_length)
+    table._add_reads(reads)
+    return table.to_arrays()
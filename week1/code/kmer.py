@@ -0,0 +1,151 @@
+import re
+
+import numpy as np
+
+BASES = 'ACGT'
+_CODE = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+# str.translate table for the complement of each base
+_COMPLEMENT = str.maketrans('ACGTacgt', 'TGCAtgca')
+# runs of anything other than ACGT, e.g. N
+_AMBIGUOUS = re.compile('[^ACGT]+')
+# 2-bit code of every byte value, 4 for anything that is not ACGT
+_BYTE_CODE = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    _BYTE_CODE[ord(_base)] = _code
+
+
+# k-mers are packed 2 bits per base, first base in the highest bits, so the
+# integer order of two codes matches the string order of the k-mers. k <= 32
+# fits a single 64-bit word; larger k becomes a multi-word python int.
+def kmer_words(k):
+    # number of 64-bit words needed to hold one packed k-mer
+    return (2 * k + 63) // 64
+
+
+def to_words(code, k):
+    # the packed k-mer as kmer_words(k) 64-bit words, most significant first
+    return [(code >> (64 * i)) & 0xFFFFFFFFFFFFFFFF for i in range(kmer_words(k) - 1, -1, -1)]
+
+
+def from_words(words):
+    code = 0
+    for word in words:
+        code = (code << 64) | int(word)
+    return code
+
+
+def encode_kmer(kmer):
+    code = 0
+    for base in kmer:
+        code = (code << 2) | _CODE[base]
+    return code
+
+
+def decode_kmer(code, k):
+    bases = [''] * k
+    for i in range(k - 1, -1, -1):
+        bases[i] = BASES[code & 3]
+        code >>= 2
+    return ''.join(bases)
+
+
+def last_base(code):
+    return BASES[code & 3]
+
+
+def encode_read(read, k):
+    # packed codes of every k-mer in the read, left to right, using a rolling
+    # window instead of slicing out each k-mer
+    mask = (1 << (2 * k)) - 1
+    codes = []
+    code = 0
+    for i, base in enumerate(read):
+        code = ((code << 2) | _CODE[base]) & mask
+        if i >= k - 1:
+            codes.append(code)
+    return codes
+
+
+def encode_read_both(read, k):
+    # like encode_read, but also returns the packed reverse complement of
+    # every window (rc[i] is the reverse complement of window i)
+    mask = (1 << (2 * k)) - 1
+    shift = 2 * (k - 1)
+    codes, rc_codes = [], []
+    code = rc_code = 0
+    for i, base in enumerate(read):
+        b = _CODE[base]
+        code = ((code << 2) | b) & mask
+        rc_code = (rc_code >> 2) | ((3 - b) << shift)
+        if i >= k - 1:
+            codes.append(code)
+            rc_codes.append(rc_code)
+    return codes, rc_codes
+
+
+def reverse_complement(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def base_codes(seq):
+    # 2-bit code of every base as a uint8 array (4 for non-ACGT)
+    return _BYTE_CODE[np.frombuffer(seq.encode('ascii'), dtype=np.uint8)]
+
+
+def kmer_array(seq, k):
+    # (codes, rc_codes) of every window of seq as uint64 arrays, as in
+    # encode_read_both but for k <= 32 only: k shift-and-or passes over the
+    # whole sequence instead of one python step per base
+    return _window_codes(base_codes(seq), k)
+
+
+def _window_codes(bases, k):
+    b = bases.astype(np.uint64)
+    n = max(len(b) - k + 1, 0)
+    codes = np.zeros(n, dtype=np.uint64)
+    rc_codes = np.zeros(n, dtype=np.uint64)
+    two, three = np.uint64(2), np.uint64(3)
+    for j in range(k):
+        codes <<= two
+        codes |= b[j:j + n]
+        rc_codes <<= two
+        rc_codes |= three - b[k - 1 - j:k - 1 - j + n]
+    return codes, rc_codes
+
+
+def split_ambiguous(reads, k):
+    # the reads cut at every base other than ACGT (lowercase acgt is read as
+    # ACGT), plus the number of k-mer windows dropped for spanning one. a
+    # batch without such bases is returned as is after one regex scan.
+    if not _AMBIGUOUS.search(''.join(reads)):
+        return reads, 0
+    fragments, skipped = [], 0
+    for read in reads:
+        if not _AMBIGUOUS.search(read):
+            fragments.append(read)
+            continue
+        parts = _AMBIGUOUS.split(read.upper())
+        kept = sum(max(len(part) - k + 1, 0) for part in parts)
+        skipped += max(len(read) - k + 1, 0) - kept
+        fragments.extend(part for part in parts if part)
+    return fragments, skipped
+
+
+def encode_reads(reads, k):
+    # encode_read_both for a batch of reads with one kmer_array pass over
+    # their concatenation; windows straddling two reads are dropped. reads
+    # must be ACGT only, see split_ambiguous
+    if k > 32:
+        return [encode_read_both(read, k) for read in reads]
+    bases = base_codes(''.join(reads))
+    if (bases > 3).any():
+        raise ValueError("reads contain bases other than ACGT")
+    codes, rc_codes = _window_codes(bases, k)
+    codes, rc_codes = codes.tolist(), rc_codes.tolist()
+    encoded = []
+    start = 0
+    for read in reads:
+        n = max(len(read) - k + 1, 0)
+        encoded.append((codes[start:start + n], rc_codes[start:start + n]))
+        start += len(read)
+    return encoded
@@ -1,24 +1,91 @@
 from dbg import DBG
-from utils import read_data
+from utils import stream_data, open_output, write_fasta, add_graph_arguments, graph_options
+import argparse
+import contextlib
 import sys
 import os
 
-sys.setrecursionlimit(1000000)
 
+def iter_contigs(dbg, max_contigs=20, min_length=0, total_bases=None):
+    # longest contigs one at a time, until max_contigs were taken (0 for no
+    # limit), the next one is shorter than min_length, or total_bases have
+    # been assembled
+    count, total = 0, 0
+    while not max_contigs or count < max_contigs:
+        c = dbg.get_longest_contig()
+        if c is None or len(c) < min_length:
+            break
+        yield c
+        count += 1
+        total += len(c)
+        if total_bases is not None and total >= total_bases:
+            break
+
+
+def run(args, f):
+    options = graph_options(args)
+    if args.load:
+        # the cleaning passes can be rerun on a snapshot, the build options not
+        dbg = DBG.load(args.load, backend=options['backend'], min_count=options['min_count'],
+                       clean=options['clean'], compact=options['compact'], profile=args.profile)
+    else:
+        short1, short2, long1 = stream_data(os.path.join('./', args.path))
+        dbg = DBG(k=args.k, data_list=[short1, short2, long1], profile=args.profile, **options)
+    if args.save:
+        dbg.save(args.save)
+    if dbg.skipped_kmers:
+        print('k-mers skipped at ambiguous bases %d' % dbg.skipped_kmers, file=sys.stderr)
+    if dbg.bloom_fp_estimate is not None:
+        print('bloom filter false-positive rate %.2e' % dbg.bloom_fp_estimate, file=sys.stderr)
+    # dbg.show_count_distribution()
+    for i, c in enumerate(iter_contigs(dbg, args.contigs, args.min_length, args.total_bases)):
+        print(i, len(c))
+        write_fasta(f, 'contig_%d' % i, c, args.line_width)
+        # contigs are streamed, so a reader on the other end gets each one
+        # as soon as it is extracted
+        f.flush()
+    if dbg.stats is not None:
+        print(dbg.stats.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
-    argv = sys.argv
-    short1, short2, long1 = read_data(os.path.join('./', argv[1]))
+    parser = argparse.ArgumentParser(description='assemble contigs from a dataset directory')
+    parser.add_argument('path', nargs='?', default=None,
+                        help='dataset directory with short_1, short_2 and long reads')
+    parser.add_argument('-o', '--output', default=None,
+                        help="contig FASTA, '-' for stdout, .gz to compress (default: path/contig.fasta)")
+    parser.add_argument('-k', type=int, default=25)
+    parser.add_argument('--contigs', type=int, default=20, help='most contigs to write, 0 for no limit')
+    parser.add_argument('--min-length', type=int, default=0, help='stop at the first shorter contig')
+    parser.add_argument('--total-bases', type=int, default=None,
+                        help='stop once this many bases are written')
+    parser.add_argument('--line-width', type=int, default=0, help='wrap sequences, 0 for one line each')
+    parser.add_argument('--load', default=None,
+                        help='snapshot to load instead of reading and building (see DBG.save)')
+    parser.add_argument('--save', default=None, help='write a snapshot of the built graph')
+    parser.add_argument('--profile', action='store_true', help='print DBG counters and timers to stderr')
+    add_graph_arguments(parser)
+    args = parser.parse_args()
+    if args.load and (args.guide_length is not None or args.bloom_capacity is not None):
+        parser.error('--guide-length and --bloom-capacity apply while building from reads, '
+                     'not with --load')
+    if args.path is None and not args.load:
+        parser.error('the dataset path is required unless --load is given')
+    if args.path is None and args.output is None:
+        parser.error('-o is required with --load when no dataset path is given')
 
-    k = 25
-    dbg = DBG(k=k, data_list=[short1, short2, long1])
-    # dbg.show_count_distribution()
-    with open(os.path.join('./', argv[1], 'contig.fasta'), 'w') as f:
-        for i in range(20):
-            c = dbg.get_longest_contig()
-            if c is None:
-                break
-            print(i, len(c))
-            f.write('>contig_%d\n' % i)
-            f.write(c + '\n')
+    output = args.output or os.path.join('./', args.path, 'contig.fasta')
+    f = open_output(output)
+    # read summaries and contig lengths go to stdout as before, unless the
+    # contigs themselves do
+    try:
+        with contextlib.redirect_stdout(sys.stderr) if f is sys.stdout else contextlib.nullcontext():
+            run(args, f)
+    except BrokenPipeError:
+        # the reader of a '-o -' pipe went away (e.g. head): point stdout at
+        # devnull so the flush at exit does not fail again, and stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if f is not sys.stdout:
+            f.close()
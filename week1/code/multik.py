@@ -0,0 +1,82 @@
+from dbg import DBG
+from utils import read_data, n50, merge_contigs, add_graph_arguments, graph_options
+import argparse
+import multiprocessing
+import os
+import time
+
+# reads shared with the worker processes. with fork they are inherited from
+# the parent instead of being pickled once per k
+_reads = None
+
+
+def _init_worker(reads):
+    global _reads
+    _reads = reads
+
+
+def assemble(job):
+    # build and traverse the graph for one k; returns the contigs and timings
+    k, num_contigs, options = job
+    start = time.perf_counter()
+    dbg = DBG(k=k, data_list=_reads, **options)
+    built = time.perf_counter()
+    contigs = []
+    for _ in range(num_contigs):
+        c = dbg.get_longest_contig()
+        if c is None:
+            break
+        contigs.append(c)
+    done = time.perf_counter()
+    return {'k': k, 'contigs': contigs, 'build': built - start, 'traverse': done - built}
+
+
+def write_contigs(filename, contigs):
+    with open(filename, 'w') as f:
+        for i, c in enumerate(contigs):
+            f.write('>contig_%d\n' % i)
+            f.write(c + '\n')
+
+
+def run(path, ks, num_contigs=20, workers=None, options=None, merge=False):
+    # parse the reads once, then assemble every k in its own process.
+    # writes contig_k<k>.fasta per k plus contig.fasta, which holds either the
+    # merged contigs or those of the k with the best N50
+    short1, short2, long1 = read_data(path)
+    reads = [short1, short2, long1]
+    workers = workers or min(len(ks), os.cpu_count() or 1)
+    jobs = [(k, num_contigs, options or {}) for k in ks]
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(reads,)) as pool:
+        results = pool.map(assemble, jobs)
+
+    print('k\tcontigs\tbases\tN50\tbuild\ttraverse')
+    for r in results:
+        lengths = [len(c) for c in r['contigs']]
+        r['n50'] = n50(lengths)
+        print('%d\t%d\t%d\t%d\t%.2fs\t%.2fs' % (r['k'], len(lengths), sum(lengths), r['n50'],
+                                               r['build'], r['traverse']))
+        write_contigs(os.path.join(path, 'contig_k%d.fasta' % r['k']), r['contigs'])
+
+    if merge:
+        contigs = merge_contigs([c for r in results for c in r['contigs']], min(ks))
+        lengths = [len(c) for c in contigs]
+        print('merged\t%d\t%d\t%d' % (len(lengths), sum(lengths), n50(lengths)))
+    else:
+        best = max(results, key=lambda r: r['n50'])
+        contigs = best['contigs']
+        print('best k', best['k'])
+    write_contigs(os.path.join(path, 'contig.fasta'), contigs)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='assemble one dataset for several k values')
+    parser.add_argument('path', help='dataset directory with short_1, short_2 and long reads')
+    parser.add_argument('-k', type=int, nargs='+', default=[21, 25, 31])
+    parser.add_argument('--contigs', type=int, default=20, help='contigs to extract per k')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per k)')
+    parser.add_argument('--merge', action='store_true', help='merge contigs across k values')
+    add_graph_arguments(parser)
+    args = parser.parse_args()
+
+    run(args.path, args.k, args.contigs, args.workers, graph_options(args), args.merge)
@@ -0,0 +1,259 @@
+from kmer import reverse_complement
+from utils import iter_reads, iter_records, merge_contigs, n50
+import argparse
+import itertools
+import multiprocessing
+import os
+
+# read pairs mapped per work unit
+BATCH_SIZE = 20000
+
+# contig index shared with the mapping workers, see _init_worker
+_index = None
+
+
+def index_contigs(contigs, k):
+    # k-mer -> (contig, position, strand) over both strands of every contig.
+    # positions are forward-strand k-mer starts. k-mers found more than once
+    # map to None so they are never used as seeds.
+    index = {}
+    for i, c in enumerate(contigs):
+        rc = reverse_complement(c)
+        n = len(c) - k + 1
+        for pos in range(n):
+            # the k-mer at pos on the reverse strand starts at n - 1 - pos in rc
+            rpos = n - 1 - pos
+            for kmer, hit in ((c[pos:pos + k], (i, pos, 1)), (rc[rpos:rpos + k], (i, pos, -1))):
+                index[kmer] = None if kmer in index else hit
+    return index
+
+
+def map_read(index, k, read):
+    # (contig, strand, start) of the read, where start is the forward-strand
+    # position of its first base (of its reverse complement for strand -1).
+    # non-overlapping k-mer seeds vote; None if no seed hits or they disagree.
+    votes = {}
+    for off in range(0, len(read) - k + 1, k):
+        hit = index.get(read[off:off + k])
+        if hit is None:
+            continue
+        contig, pos, strand = hit
+        start = pos - off if strand == 1 else pos - (len(read) - off - k)
+        key = (contig, strand, start)
+        votes[key] = votes.get(key, 0) + 1
+    if not votes:
+        return None
+    best = max(votes, key=votes.get)
+    if 2 * votes[best] <= sum(votes.values()):
+        return None
+    return best
+
+
+def map_pairs(job):
+    # map one batch of pairs. returns inserts of pairs that land in one
+    # contig (split by whether the mates face opposite strands) and the raw
+    # placements of pairs whose mates land in different contigs
+    k, pairs = job
+    inserts = {True: [], False: []}
+    links = []
+    for read1, read2 in pairs:
+        m1 = map_read(_index, k, read1)
+        if m1 is None:
+            continue
+        m2 = map_read(_index, k, read2)
+        if m2 is None:
+            continue
+        if m1[0] == m2[0]:
+            inserts[m1[1] != m2[1]].append((m2[2] - m1[2]) * m1[1] + len(read2))
+        else:
+            links.append((m1, len(read1), m2, len(read2)))
+    return inserts, links
+
+
+def _init_worker(index):
+    global _index
+    _index = index
+
+
+def iter_pairs(path, batch_size=BATCH_SIZE):
+    # short_1 and short_2 streamed side by side, in batches of pairs. both
+    # files are read to the end, so a mate file with extra reads is an error
+    # instead of being cut silently.
+    batch = []
+    pairs = itertools.zip_longest(iter_reads(path, "short_1.fasta"),
+                                  iter_reads(path, "short_2.fasta"))
+    for pair in pairs:
+        if None in pair:
+            longer = "short_1" if pair[1] is None else "short_2"
+            raise ValueError("%s: %s has more reads than its mate file, the reads are not paired"
+                             % (path, longer))
+        batch.append(pair)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def _oriented_start(contig_len, mapping, read_len, orientation):
+    # start of the read once its contig is used in the given orientation
+    _, _, start = mapping
+    return start if orientation == 1 else contig_len - start - read_len
+
+
+def count_links(lengths, links, insert, opposite):
+    # (A, oA, B, oB) -> gap estimates, for "contig A in orientation oA is
+    # followed by B in orientation oB". mate 2 is turned onto mate 1's
+    # strand (reverse complemented for opposite-strand libraries), then each
+    # pair spans A's far end and B's near end.
+    edges = {}
+    for m1, len1, m2, len2 in links:
+        a, oa = m1[0], m1[1]
+        b, ob = m2[0], -m2[1] if opposite else m2[1]
+        to_end = lengths[a] - _oriented_start(lengths[a], m1, len1, oa)
+        from_start = _oriented_start(lengths[b], m2, len2, ob) + len2
+        gap = insert - to_end - from_start
+        # the same join read from the other strand is B- then A-
+        key = min((a, oa, b, ob), (b, -ob, a, -oa))
+        edges.setdefault(key, []).append(gap)
+    return edges
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def order_contigs(n, edges, min_links, max_overlap):
+    # greedy: best supported joins first, each contig end used once and no
+    # cycles. joins implying an overlap longer than max_overlap come from
+    # repeats and are skipped. returns scaffolds as lists of
+    # (contig, orientation, gap before)
+    exit_end = lambda c, o: (c, o)
+    entry_end = lambda c, o: (c, -o)
+    parent = list(range(n))
+    joined = {}
+    for (a, oa, b, ob), gaps in sorted(edges.items(), key=lambda e: len(e[1]), reverse=True):
+        if len(gaps) < min_links:
+            break
+        end1, end2 = exit_end(a, oa), entry_end(b, ob)
+        if end1 in joined or end2 in joined or _find(parent, a) == _find(parent, b):
+            continue
+        gap = _median(gaps)
+        if gap < -max_overlap:
+            continue
+        joined[end1], joined[end2] = (end2, gap), (end1, gap)
+        parent[_find(parent, a)] = _find(parent, b)
+
+    scaffolds, seen = [], set()
+    # chains start at a contig with a free end; ends are (contig, +1) for the
+    # right end and (contig, -1) for the left one
+    for c in range(n):
+        if c in seen:
+            continue
+        if (c, -1) not in joined:
+            o = 1
+        elif (c, 1) not in joined:
+            o = -1
+        else:
+            continue
+        chain, gap = [], 0
+        while True:
+            chain.append((c, o, gap))
+            seen.add(c)
+            nxt = joined.get(exit_end(c, o))
+            if nxt is None:
+                break
+            (c, end), gap = nxt
+            o = -end
+        scaffolds.append(chain)
+    return scaffolds
+
+
+def join_scaffold(contigs, chain, min_gap=10, min_overlap=20):
+    # gaps become runs of N. a negative gap means the contigs should overlap;
+    # the overlap is merged if the sequences agree, else min_gap Ns are used
+    parts = []
+    for c, o, gap in chain:
+        seq = contigs[c] if o == 1 else reverse_complement(contigs[c])
+        if parts:
+            prev = parts[-1]
+            overlap = 0
+            if gap < min_overlap:
+                for size in range(min(len(prev), len(seq), min_overlap - gap), min_overlap - 1, -1):
+                    if prev[-size:] == seq[:size]:
+                        overlap = size
+                        break
+            if overlap:
+                seq = seq[overlap:]
+            else:
+                parts.append('N' * max(gap, min_gap))
+        parts.append(seq)
+    return ''.join(parts)
+
+
+def scaffold(contigs, path, k=25, min_links=3, workers=1, batch_size=BATCH_SIZE):
+    # contigs -> scaffolds, from the short read pairs under path. returns
+    # (scaffolds, insert size, orientation). contigs come in pairs from both
+    # strands, which differ where they took different branches, so anything
+    # half covered by a longer contig is dropped before indexing
+    contigs = merge_contigs(contigs, k, min_shared=0.5)
+    index = index_contigs(contigs, k)
+    jobs = ((k, batch) for batch in iter_pairs(path, batch_size))
+    inserts = {True: [], False: []}
+    links = []
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(index,))
+        results = pool.imap(map_pairs, jobs)
+    else:
+        _init_worker(index)
+        pool, results = None, map(map_pairs, jobs)
+    for batch_inserts, batch_links in results:
+        inserts[True].extend(batch_inserts[True])
+        inserts[False].extend(batch_inserts[False])
+        links.extend(batch_links)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # the library layout and insert size come from pairs inside one contig
+    opposite = len(inserts[True]) >= len(inserts[False])
+    if not inserts[opposite]:
+        return contigs, None, opposite
+    insert = _median(inserts[opposite])
+    edges = count_links([len(c) for c in contigs], links, insert, opposite)
+    chains = order_contigs(len(contigs), edges, min_links, insert)
+    scaffolds = [join_scaffold(contigs, chain) for chain in chains]
+    scaffolds.sort(key=len, reverse=True)
+    return scaffolds, insert, opposite
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='join contigs into scaffolds using the read pairs')
+    parser.add_argument('path', help='dataset directory with short_1 and short_2')
+    parser.add_argument('--contigs', default=None, help='contig FASTA (default: path/contig.fasta)')
+    parser.add_argument('-o', '--output', default=None, help='scaffold FASTA (default: path/scaffold.fasta)')
+    parser.add_argument('-k', type=int, default=25, help='seed length for mapping reads')
+    parser.add_argument('--min-links', type=int, default=3, help='read pairs needed to join two contigs')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    contig_file = args.contigs or os.path.join(args.path, 'contig.fasta')
+    contigs = [seq for _, seq in iter_records(contig_file)]
+    scaffolds, insert, opposite = scaffold(contigs, args.path, args.k, args.min_links,
+                                           args.workers, args.batch_size)
+    print('insert', insert, 'opposite strands' if opposite else 'same strand')
+    print('contigs N50', n50([len(c) for c in contigs]), 'scaffolds N50', n50([len(s) for s in scaffolds]))
+    with open(args.output or os.path.join(args.path, 'scaffold.fasta'), 'w') as f:
+        for i, s in enumerate(scaffolds):
+            print(i, len(s))
+            f.write('>scaffold_%d\n' % i)
+            f.write(s + '\n')
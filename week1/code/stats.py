@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+
+
+class DBGStats:
+    # counters and timers filled in by DBG(profile=True). build counters are
+    # gathered per read or per phase, never per k-mer, so profiling does not
+    # slow down the build loops it measures.
+    def __init__(self):
+        # build
+        self.reads = 0
+        self.bases = 0
+        self.kmer_windows = 0
+        self.nodes_created = 0
+        self.arcs_created = 0
+        self.rc_calls = 0
+        self.skipped_kmers = 0
+        # seconds per phase: build, filter, clean, compact, freeze, and
+        # summed over the get_longest_contig calls, depth, concat, delete
+        self.timers = {}
+        # one entry per get_longest_contig call
+        self.contig_seconds = []
+        self.depth_visits = []
+        self.deleted_nodes = []
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - start
+
+    def count_reads(self, data, k):
+        # pass reads through, counting them, their bases and k-mer windows
+        for read in data:
+            self.reads += 1
+            self.bases += len(read)
+            self.kmer_windows += max(len(read) - k + 1, 0)
+            yield read
+
+    def as_dict(self):
+        return {
+            'reads': self.reads,
+            'bases': self.bases,
+            'kmer_windows': self.kmer_windows,
+            'nodes_created': self.nodes_created,
+            'arcs_created': self.arcs_created,
+            'rc_calls': self.rc_calls,
+            'skipped_kmers': self.skipped_kmers,
+            'timers': dict(self.timers),
+            'contig_seconds': list(self.contig_seconds),
+            'depth_visits': list(self.depth_visits),
+            'deleted_nodes': list(self.deleted_nodes),
+        }
+
+    def report(self):
+        lines = ['reads %d (%d bases, %d k-mer windows)'
+                 % (self.reads, self.bases, self.kmer_windows),
+                 'nodes created %d, arcs created %d, reverse complements %d'
+                 % (self.nodes_created, self.arcs_created, self.rc_calls),
+                 'k-mers skipped at ambiguous bases %d' % self.skipped_kmers]
+        for name, seconds in self.timers.items():
+            lines.append('%s %.3fs' % (name, seconds))
+        for i, seconds in enumerate(self.contig_seconds):
+            lines.append('contig %d %.3fs, %d nodes visited, %d deleted'
+                         % (i, seconds, self.depth_visits[i], self.deleted_nodes[i]))
+        return '\n'.join(lines)
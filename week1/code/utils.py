@@ -1,14 +1,114 @@
+import bz2
+import gzip
 import os
+import sys
 
+from kmer import reverse_complement
 
-def read_fasta(path, name):
-    data = []
-    with open(os.path.join(path, name), 'r') as f:
-        for line in f.readlines():
+# read files are looked up by stem, so short_1.fasta, short_1.fq.gz or
+# short_1.fasta.bz2 all work
+READ_EXTENSIONS = ['.fasta', '.fa', '.fastq', '.fq']
+COMPRESSED_EXTENSIONS = ['', '.gz', '.bz2']
+
+
+def open_reads(filename):
+    # text handle for plain, gzip or bz2 files, picked by extension
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    if filename.endswith('.bz2'):
+        return bz2.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+def find_reads(path, name):
+    # resolve a read file name like short_1.fasta to whichever variant exists
+    stem = name
+    for ext in READ_EXTENSIONS:
+        if name.endswith(ext):
+            stem = name[:-len(ext)]
+    for ext in [name[len(stem):]] + READ_EXTENSIONS:
+        for comp in COMPRESSED_EXTENSIONS:
+            filename = os.path.join(path, stem + ext + comp)
+            if ext and os.path.exists(filename):
+                return filename
+    raise FileNotFoundError(os.path.join(path, name))
+
+
+def iter_records(filename):
+    # yields (name, sequence) from a FASTA or FASTQ file one record at a time.
+    # FASTA records may span several lines; FASTQ quality lines are skipped by
+    # length, so a quality line starting with '@' is not mistaken for a header
+    with open_reads(filename) as f:
+        name, seq = None, []
+        fastq = None
+        for line in f:
             line = line.strip()
-            if line[0] != '>':
-                data.append(line)
-    print(name, len(data), len(data[0]))
+            if not line:
+                continue
+            if fastq is None:
+                fastq = line[0] == '@'
+            if fastq:
+                if line[0] == '+' and name is not None:
+                    sequence = ''.join(seq)
+                    quality = 0
+                    while quality < len(sequence):
+                        qual = next(f, None)
+                        if qual is None:
+                            raise ValueError("%s: truncated FASTQ record %r, its quality is "
+                                             "shorter than its sequence" % (filename, name))
+                        quality += len(qual.strip())
+                    yield name, sequence
+                    name, seq = None, []
+                elif name is None:
+                    name = line[1:]
+                else:
+                    seq.append(line)
+            elif line[0] == '>':
+                if name is not None:
+                    yield name, ''.join(seq)
+                name, seq = line[1:], []
+            else:
+                seq.append(line)
+        if name is not None:
+            if fastq:
+                raise ValueError("%s: truncated FASTQ record %r, it has no '+' line"
+                                 % (filename, name))
+            yield name, ''.join(seq)
+
+
+def iter_reads(path, name):
+    # streams the sequences of one read file and prints the same summary line
+    # as read_fasta once the file has been consumed
+    count, first_len = 0, 0
+    for _, seq in iter_records(find_reads(path, name)):
+        if count == 0:
+            first_len = len(seq)
+        count += 1
+        yield seq
+    print(name, count, first_len)
+
+
+def open_output(filename):
+    # text handle for writing; '-' is stdout and a .gz name is gzip-compressed
+    if filename == '-':
+        return sys.stdout
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt')
+    return open(filename, 'w')
+
+
+def write_fasta(f, name, seq, width=0):
+    # one FASTA record, wrapped every width bases (0 keeps one line)
+    f.write('>%s\n' % name)
+    if width <= 0:
+        f.write(seq + '\n')
+        return
+    for i in range(0, len(seq), width):
+        f.write(seq[i:i + width] + '\n')
+
+
+def read_fasta(path, name):
+    data = list(iter_reads(path, name))
     # print('Sample:', data[0])
     return data
 
@@ -18,3 +118,77 @@ def read_data(path):
     short2 = read_fasta(path, "short_2.fasta")
     long1 = read_fasta(path, "long.fasta")
     return short1, short2, long1
+
+
+def stream_data(path):
+    # same inputs as read_data, as lazy iterators for DBG to consume
+    short1 = iter_reads(path, "short_1.fasta")
+    short2 = iter_reads(path, "short_2.fasta")
+    long1 = iter_reads(path, "long.fasta")
+    return short1, short2, long1
+
+
+def _nx(lengths, target):
+    # (length, number of contigs) at which the running total of the contig
+    # lengths, longest first, reaches target; (0, 0) if it never does
+    total = 0
+    for i, length in enumerate(sorted(lengths, reverse=True)):
+        total += length
+        if total >= target:
+            return length, i + 1
+    return 0, 0
+
+
+def n50(lengths):
+    # length of the contig that takes the running total (longest first) to
+    # half of the assembly, as in evaluate.sh; 0 for no contigs
+    return _nx(lengths, sum(lengths) // 2)[0]
+
+
+def ng50(lengths, genome_size):
+    # like n50, but against half of the genome size instead of the assembly
+    return _nx(lengths, genome_size // 2)[0]
+
+
+def l50(lengths):
+    # number of contigs needed to reach the n50
+    return _nx(lengths, sum(lengths) // 2)[1]
+
+
+def merge_contigs(contigs, k, min_shared=0.9):
+    # pool contigs from every k, longest first, and drop a contig when at
+    # least min_shared of its k-mers (either strand) are already in a kept
+    # one. contigs of neighbouring k values cover the same region with
+    # slightly different ends, so plain substring checks would keep both.
+    kept, seen = [], set()
+    for c in sorted(contigs, key=len, reverse=True):
+        kmers = [c[i:i + k] for i in range(len(c) - k + 1)]
+        if not kmers or sum(kmer in seen for kmer in kmers) >= min_shared * len(kmers):
+            continue
+        kept.append(c)
+        seen.update(kmers)
+        seen.update(reverse_complement(kmer) for kmer in kmers)
+    return kept
+
+
+def add_graph_arguments(parser):
+    # command line flags for the DBG options shared by the scripts
+    parser.add_argument('--backend', choices=['dict', 'csr'], default='dict')
+    parser.add_argument('--min-count', default=None,
+                        help="drop k-mers seen fewer times ('auto' for the histogram valley)")
+    parser.add_argument('--clean', action='store_true', help='clip tips and pop bubbles')
+    parser.add_argument('--compact', action='store_true', help='collapse unitigs before traversal')
+    parser.add_argument('--guide-length', type=int, default=None,
+                        help='reads at least this long guide branch choices')
+    parser.add_argument('--bloom-capacity', type=int, default=None,
+                        help='expected distinct k-mers; turns on the Bloom-filtered build')
+
+
+def graph_options(args):
+    # DBG keyword arguments from the flags of add_graph_arguments
+    min_count = args.min_count
+    if min_count is not None and min_count != 'auto':
+        min_count = int(min_count)
+    return {'backend': args.backend, 'min_count': min_count, 'clean': args.clean,
+            'compact': args.compact, 'guide_length': args.guide_length,
+            'bloom_capacity': args.bloom_capacity}
@@ -57,11 +57,6 @@ for i in 1 2 3 4; do
   ds="${DATA_DIR}/data$i"
   [[ -d "$ds" ]] || { echo "skip data$i (missing $ds)" >&2; continue; }
 
-  # raise stack limit, my laptop can't handle this so it just outputs message below
-  if [[ "$ds" == "week1/data/data4" ]]; then
-    ulimit -s 8192000 2>/dev/null || echo "Could not raise stack size" >&2
-  fi
-
   # python
   start=$(date +%s)
   py_out=$(python3 "$PYTHON_SCRIPT" "$ds")
@@ -0,0 +1,98 @@
+"""Tests for the de Bruijn graph assembler on a small synthetic read set."""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+from dbg import DBG  # noqa: E402
+from utils import iter_records  # noqa: E402
+
+K = 25
+
+
+@pytest.fixture(scope='module')
+def reads():
+    # 1500 reads of 100 bases from both strands of a random 10 kb genome,
+    # with 0.5% substitution errors so the graph has tips and bubbles
+    rng = random.Random(1)
+    genome = ''.join(rng.choice('ACGT') for _ in range(10000))
+    comp = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+    reads = []
+    for _ in range(1500):
+        i = rng.randrange(len(genome) - 100)
+        read = genome[i:i + 100]
+        if rng.random() < 0.5:
+            read = ''.join(comp[c] for c in reversed(read))
+        reads.append(''.join(rng.choice('ACGT') if rng.random() < 0.005 else c for c in read))
+    return reads
+
+
+def contigs(dbg, n=5):
+    return [dbg.get_longest_contig() for _ in range(n)]
+
+
+@pytest.fixture(scope='module')
+def serial(reads):
+    return contigs(DBG(K, [reads]))
+
+
+@pytest.mark.parametrize('options', [{}, {'compact': True}, {'guide_length': 90}])
+def test_incremental(reads, options):
+    # repairing depths after each contig gives what a full recompute gives
+    full = contigs(DBG(K, [reads], backend='csr', **options))
+    repaired = contigs(DBG(K, [reads], backend='csr', incremental=True, **options))
+    assert repaired == full
+    assert full[0]
+
+
+def test_incremental_needs_csr(reads):
+    with pytest.raises(ValueError):
+        DBG(K, [reads], incremental=True)
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'reads.fastq'
+    path.write_text(text)
+    return str(path)
+
+
+def test_fastq(tmp_path):
+    # a quality line may start with '@' or '+'
+    path = write(tmp_path, '@r1\nACGT\n+\n@@+I\n@r2\nGGCC\n+r2\n+III\n')
+    assert list(iter_records(path)) == [('r1', 'ACGT'), ('r2', 'GGCC')]
+
+
+@pytest.mark.parametrize('text', [
+    '@r1\nACGT\n+\nIIII\n@r2\nGGCCAA\n+\nII\n',  # quality shorter than the sequence
+    '@r1\nACGT\n+\nIIII\n@r2\nGGCC\n',  # no '+' line
+])
+def test_fastq_truncated(tmp_path, text):
+    with pytest.raises(ValueError, match='truncated FASTQ'):
+        list(iter_records(write(tmp_path, text)))
+
+
+@pytest.mark.parametrize('options', [{}, {'backend': 'csr'}, {'min_count': 2}])
+def test_workers(reads, options):
+    # counting shards in a process pool builds the same graph as one process
+    assert contigs(DBG(K, [reads], workers=2, **options)) == contigs(DBG(K, [reads], **options))
+
+
+@pytest.mark.parametrize('backend', ['csr', 'dict'])
+def test_save_load(reads, serial, tmp_path, backend):
+    path = str(tmp_path / 'snapshot')
+    DBG(K, [reads]).save(path)
+    assert contigs(DBG.load(path, backend=backend)) == serial
+
+
+def test_save_load_after_contigs(reads, tmp_path):
+    # contigs already taken stay deleted in the snapshot
+    dbg = DBG(K, [reads], backend='csr')
+    first = dbg.get_longest_contig()
+    path = str(tmp_path / 'snapshot')
+    dbg.save(path)
+    assert first not in contigs(DBG.load(path))
+    assert contigs(DBG.load(path), 4) == contigs(dbg, 4)
@@ -219,6 +219,8 @@ class Motif:
         self.pseudocounts = None
         self.background = None
         self.mask = None
+        # see _matrices
+        self._cache = None
 
     def __get_mask(self):
         return self.__mask
@@ -334,15 +336,54 @@ class Motif:
         motif.background = self.background.copy()
         return motif
 
+    def _matrices(self):
+        """Return the position weight and scoring matrices (PRIVATE).
+
+        Both are computed at once from a (length x alphabet) array of the
+        counts, and kept until the counts, pseudocounts, or background
+        change, including by changing their values in place. They keep
+        their values in array storage, so calculate and search use the
+        array as it is, and are read-only as every caller shares them.
+        """
+        from . import matrix
+
+        alphabet = self.alphabet
+        counts = np.array([self.counts[letter] for letter in alphabet], float).T
+        pseudocounts = [self._pseudocounts[letter] for letter in alphabet]
+        background = [self._background[letter] for letter in alphabet]
+        key = (pseudocounts, background)
+        if self._cache is not None:
+            cached_key, cached_counts, pwm, pssm = self._cache
+            if cached_key == key and np.array_equal(cached_counts, counts):
+                return pwm, pssm
+        pwm = matrix.FrequencyPositionMatrix(alphabet, counts).normalize(
+            self._pseudocounts
+        )
+        pssm = pwm.log_odds(self._background)
+        pwm._set_read_only()
+        pssm._set_read_only()
+        self._cache = key, counts, pwm, pssm
+        return pwm, pssm
+
     @property
     def pwm(self):
-        """Calculate and return the position weight matrix for this motif."""
-        return self.counts.normalize(self._pseudocounts)
+        """Return the position weight matrix for this motif.
+
+        The matrix is cached and the same object is returned until the
+        counts, pseudocounts, or background of the motif change. Its
+        values are therefore read-only. Each letter maps to a numpy array
+        rather than the tuple normalize returns; use copy.copy(motif.pwm)
+        for a matrix that can be modified.
+        """
+        return self._matrices()[0]
 
     @property
     def pssm(self):
-        """Calculate and return the position specific scoring matrix for this motif."""
-        return self.pwm.log_odds(self._background)
+        """Return the position specific scoring matrix for this motif.
+
+        The matrix is cached in the same way as the pwm.
+        """
+        return self._matrices()[1]
 
     def __str__(self, masked=False):
         """Return string representation of a motif."""
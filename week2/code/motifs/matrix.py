@@ -11,8 +11,13 @@ Implementation of frequency (count) matrices, position-weight matrices,
 and position-specific scoring matrices.
 """
 
+import functools
 import math
+import mmap
 import numbers
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
@@ -21,11 +26,72 @@ from Bio.Seq import Seq
 from . import _pwm  # type: ignore
 
 
+# Maps each byte to its column in an "ACGT" log-odds table. Lower case is
+# folded here, and any other byte maps to 4, which scores as NaN.
+_CODES = np.full(256, 4, np.uint8)
+for _i, _letter in enumerate(b"ACGT"):
+    _CODES[_letter] = _i
+    _CODES[_letter + 32] = _i
+del _i, _letter
+
+
+def _as_array(sequence):
+    """Return the letters of the sequence as an array of bytes (PRIVATE).
+
+    Objects supporting the buffer protocol, such as bytes, bytearray, mmap,
+    or a numpy memmap of a sequence file, are used in place, not copied.
+    """
+    try:
+        return np.frombuffer(sequence, np.uint8)
+    except TypeError:
+        pass
+    try:
+        sequence = bytes(sequence)
+    except TypeError:  # str
+        try:
+            sequence = bytes(sequence, "ASCII")
+        except TypeError:
+            raise ValueError(
+                "sequence should be a Seq, MutableSeq, string, or bytes-like object"
+            ) from None
+        except UnicodeEncodeError:
+            raise ValueError("sequence should contain ASCII characters only") from None
+    except Exception:
+        raise ValueError(
+            "sequence should be a Seq, MutableSeq, string, or bytes-like object"
+        ) from None
+    return np.frombuffer(sequence, np.uint8)
+
+
 class GenericPositionMatrix(dict):
-    """Base class for the support of position matrix operations."""
+    """Base class for the support of position matrix operations.
+
+    The values are given as a dictionary with a list of values for each
+    letter of the alphabet, which the matrix then stores in the same way.
+    Alternatively, they can be given as a 2-D NumPy array with one row per
+    position and one column per letter. The matrix then keeps the values
+    in one array, and each letter maps to a view of its column, so that
+    m['A'] and m['A', i] work as before. Properties such as consensus, and
+    max and min for a PSSM, are then computed by array operations rather
+    than per position and letter, and matrices derived from the matrix
+    (by normalize, log_odds, reverse_complement, or slicing) use arrays as
+    well.
+    """
+
+    # 2-D array of the values in array storage, None otherwise
+    _array = None
 
     def __init__(self, alphabet, values):
         """Initialize the class."""
+        if isinstance(values, np.ndarray):
+            if values.ndim != 2 or values.shape[1] != len(alphabet):
+                raise ValueError("values should have one column per letter")
+            self._array = np.array(values, float, order="C")
+            self.length = len(self._array)
+            for letter, column in zip(alphabet, self._array.T):
+                dict.__setitem__(self, letter, column)
+            self.alphabet = alphabet
+            return
         self.length = None
         for letter in alphabet:
             if self.length is None:
@@ -36,6 +102,51 @@ class GenericPositionMatrix(dict):
             self[letter] = [float(_) for _ in values[letter]]
         self.alphabet = alphabet
 
+    def _set_read_only(self):
+        """Make the values of a matrix in array storage read-only (PRIVATE)."""
+        self._array.flags.writeable = False
+        for letter in self.alphabet:
+            dict.__getitem__(self, letter).flags.writeable = False
+
+    def __setitem__(self, letter, values):
+        """Set the values of a letter, in place if the matrix uses an array."""
+        if self._array is None:
+            dict.__setitem__(self, letter, values)
+        else:
+            self._array[:, self.alphabet.index(letter)] = values
+
+    def __reduce_ex__(self, protocol):
+        """Support pickle and copy.
+
+        A matrix in array storage is rebuilt from its array, so that the
+        values of each letter are again views of its columns.
+        """
+        if self._array is None:
+            return super().__reduce_ex__(protocol)
+        state = self.__dict__.copy()
+        del state["_array"]
+        return _rebuild, (self.__class__, self.alphabet, self._array), state
+
+    def __eq__(self, other):
+        """Return True if both matrices have the same letters and values."""
+        if self._array is None and getattr(other, "_array", None) is None:
+            return dict.__eq__(self, other)
+        if not isinstance(other, dict):
+            return NotImplemented
+        if self.keys() != other.keys():
+            return False
+        return all(
+            np.array_equal(self[letter], other[letter], equal_nan=True)
+            for letter in self
+        )
+
+    def __ne__(self, other):
+        """Return True if the matrices differ in their letters or values."""
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
     def __str__(self):
         """Return a string containing nucleotides and counts of the alphabet in the Matrix."""
         words = ["%6d" % i for i in range(self.length)]
@@ -97,6 +208,8 @@ class GenericPositionMatrix(dict):
                         values = dict.__getitem__(self, letter1)
                         d[letter1] = [values[_] for _ in indices2]
                     if sorted(letters1) == self.alphabet:
+                        if self._array is not None:
+                            d = np.column_stack([d[letter] for letter in self.alphabet])
                         return self.__class__(self.alphabet, d)
                     else:
                         return d
@@ -136,6 +249,11 @@ class GenericPositionMatrix(dict):
     @property
     def consensus(self):
         """Return the consensus sequence."""
+        if self._array is not None:
+            letters = np.array(list(self.alphabet))
+            # NaN values are never the maximum, as in the loop below
+            values = np.where(np.isnan(self._array), -math.inf, self._array)
+            return Seq("".join(letters[np.argmax(values, axis=1)]))
         sequence = ""
         for i in range(self.length):
             maximum = -math.inf
@@ -150,6 +268,10 @@ class GenericPositionMatrix(dict):
     @property
     def anticonsensus(self):
         """Return the anticonsensus sequence."""
+        if self._array is not None:
+            letters = np.array(list(self.alphabet))
+            values = np.where(np.isnan(self._array), math.inf, self._array)
+            return Seq("".join(letters[np.argmin(values, axis=1)]))
         sequence = ""
         for i in range(self.length):
             minimum = math.inf
@@ -289,6 +411,9 @@ class GenericPositionMatrix(dict):
     def gc_content(self):
         """Compute the fraction GC content."""
         alphabet = self.alphabet
+        if self._array is not None:
+            gc = [letter in "CG" for letter in alphabet]
+            return self._array[:, gc].sum() / self._array.sum()
         gc_total = 0.0
         total = 0.0
         for i in range(self.length):
@@ -300,6 +425,12 @@ class GenericPositionMatrix(dict):
 
     def reverse_complement(self):
         """Compute reverse complement."""
+        if self._array is not None:
+            T_or_U = "U" if self.alphabet == "ACGU" else "T"
+            complement = {"A": T_or_U, T_or_U: "A", "G": "C", "C": "G"}
+            alphabet = self.alphabet
+            columns = [alphabet.index(complement[letter]) for letter in alphabet]
+            return self.__class__(alphabet, self._array[::-1, columns])
         values = {}
         if self.alphabet == "ACGU":
             values["A"] = self["U"][::-1]
@@ -313,6 +444,17 @@ class GenericPositionMatrix(dict):
         return self.__class__(alphabet, values)
 
 
+def _rebuild(cls, alphabet, array):
+    """Recreate a matrix in array storage, for pickle and copy (PRIVATE).
+
+    The subclass initializer is skipped, as the values were already
+    processed (e.g. normalized) when the matrix was first created.
+    """
+    matrix = cls.__new__(cls)
+    GenericPositionMatrix.__init__(matrix, alphabet, array)
+    return matrix
+
+
 class FrequencyPositionMatrix(GenericPositionMatrix):
     """Class for the support of frequency calculations on the Position Matrix."""
 
@@ -328,6 +470,13 @@ class FrequencyPositionMatrix(GenericPositionMatrix):
         Alternatively, the pseudocounts can be a dictionary with a key
         for each letter in the alphabet associated with the motif.
         """
+        if self._array is not None:
+            if pseudocounts is None:
+                pseudocounts = 0.0
+            if isinstance(pseudocounts, dict):
+                pseudocounts = [pseudocounts[letter] for letter in self.alphabet]
+            values = self._array + np.array(pseudocounts, float)
+            return PositionWeightMatrix(self.alphabet, values)
         counts = {}
         if pseudocounts is None:
             for letter in self.alphabet:
@@ -351,6 +500,13 @@ class PositionWeightMatrix(GenericPositionMatrix):
     def __init__(self, alphabet, counts):
         """Initialize the class."""
         GenericPositionMatrix.__init__(self, alphabet, counts)
+        if self._array is not None:
+            # Summed letter by letter, as below
+            total = self._array[:, 0].copy()
+            for k in range(1, len(alphabet)):
+                total += self._array[:, k]
+            self._array /= total[:, None]
+            return
         for i in range(self.length):
             total = sum(self[letter][i] for letter in alphabet)
             for letter in alphabet:
@@ -376,6 +532,13 @@ class PositionWeightMatrix(GenericPositionMatrix):
         for letter in alphabet:
             background[letter] /= total
             values[letter] = []
+        if self._array is not None:
+            background = np.array([background[letter] for letter in alphabet])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # log(0) gives -inf; dividing by a zero background gives
+                # inf, or nan where p is zero too
+                logodds = np.log(self._array / background) / np.log(2)
+            return PositionSpecificScoringMatrix(alphabet, logodds)
         for i in range(self.length):
             for letter in alphabet:
                 b = background[letter]
@@ -418,33 +581,24 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
 
         # NOTE: The C code handles mixed case input as this could be large
         # (e.g. contig or chromosome), so requiring it be all upper or lower
-        # case would impose an overhead to allocate the extra memory.
-        try:
-            sequence = bytes(sequence)
-        except TypeError:  # str
-            try:
-                sequence = bytes(sequence, "ASCII")
-            except TypeError:
-                raise ValueError(
-                    "sequence should be a Seq, MutableSeq, string, or bytes-like object"
-                ) from None
-            except UnicodeEncodeError:
-                raise ValueError(
-                    "sequence should contain ASCII characters only"
-                ) from None
-        except Exception:
-            raise ValueError(
-                "sequence should be a Seq, MutableSeq, string, or bytes-like object"
-            ) from None
+        # case would impose an overhead to allocate the extra memory. For the
+        # same reason, buffers such as a memory-mapped file are not copied.
+        sequence = _as_array(sequence)
 
         n = len(sequence)
         m = self.length
         # Create the numpy arrays here; the C module then does not rely on numpy
         # Use a float32 for the scores array to save space
         scores = np.empty(n - m + 1, np.float32)
-        logodds = np.array(
-            [[self[letter][i] for letter in "ACGT"] for i in range(m)], float
-        )
+        if self.alphabet == "ACGT" and self._array is not None:
+            logodds = self._array
+        elif self._array is not None:
+            columns = [self.alphabet.index(letter) for letter in "ACGT"]
+            logodds = np.ascontiguousarray(self._array[:, columns])
+        else:
+            logodds = np.column_stack(
+                [np.asarray(self[letter], float) for letter in "ACGT"]
+            )
         _pwm.calculate(sequence, logodds, scores)
 
         if len(scores) == 1:
@@ -452,38 +606,23 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         else:
             return scores
 
-    def search(self, sequence, threshold=0.0, both=True, chunksize=10**6):
+    def search(self, sequence, threshold=0.0, both=True, chunksize=10**6, workers=1):
         """Find hits with PWM score above given threshold.
 
         A generator function, returning found hits in the given sequence
         with the pwm score higher than the threshold.
+
+        The sequence is scored in chunks of chunksize positions, and only
+        one chunk at a time is copied or converted, so that a chromosome
+        can be given as a memory-mapped file (e.g. a numpy memmap of the
+        sequence line of a FASTA file). Lower case letters are scored as
+        upper case. With more than one worker, the chunks are scored in a
+        pool of that many processes; see batch_search for how the sequence
+        is shared.
         """
-        sequence = sequence.upper()
-        seq_len = len(sequence)
-        motif_l = self.length
-        chunk_starts = np.arange(0, seq_len, chunksize)
-        if both:
-            rc = self.reverse_complement()
-        for chunk_start in chunk_starts:
-            subseq = sequence[chunk_start : chunk_start + chunksize + motif_l - 1]
-            pos_scores = self.calculate(subseq)
-            pos_ind = pos_scores >= threshold
-            pos_positions = np.where(pos_ind)[0] + chunk_start
-            pos_scores = pos_scores[pos_ind]
-            if both:
-                neg_scores = rc.calculate(subseq)
-                neg_ind = neg_scores >= threshold
-                neg_positions = np.where(neg_ind)[0] + chunk_start
-                neg_scores = neg_scores[neg_ind]
-            else:
-                neg_positions = np.empty((0), dtype=int)
-                neg_scores = np.empty((0), dtype=int)
-            chunk_positions = np.append(pos_positions, neg_positions - seq_len)
-            chunk_scores = np.append(pos_scores, neg_scores)
-            order = np.argsort(np.append(pos_positions, neg_positions))
-            chunk_positions = chunk_positions[order]
-            chunk_scores = chunk_scores[order]
-            yield from zip(chunk_positions, chunk_scores)
+        rc = self.reverse_complement() if both else None
+        scan = functools.partial(_search_chunk, self, rc, threshold, len(sequence))
+        yield from _scan_chunks(scan, sequence, chunksize, self.length - 1, workers)
 
     @property
     def max(self):
@@ -491,6 +630,10 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
 
         returns the score computed for the consensus sequence.
         """
+        if self._array is not None:
+            # NaN scores are skipped, as in consensus
+            values = np.where(np.isnan(self._array), -math.inf, self._array)
+            return float(values.max(axis=1).sum())
         score = 0.0
         letters = self.alphabet
         for position in range(self.length):
@@ -503,6 +646,9 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
 
         returns the score computed for the anticonsensus sequence.
         """
+        if self._array is not None:
+            values = np.where(np.isnan(self._array), math.inf, self._array)
+            return float(values.min(axis=1).sum())
         score = 0.0
         letters = self.alphabet
         for position in range(self.length):
@@ -523,6 +669,8 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         total = sum(background.values())
         for letter in self.alphabet:
             background[letter] /= total
+        if self._array is not None:
+            return float(self._terms(background)[0].sum())
         sx = 0.0
         for i in range(self.length):
             for letter in self.alphabet:
@@ -536,6 +684,20 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
                 sx += p * logodds
         return sx
 
+    def _terms(self, background):
+        """Return the p * logodds and p * logodds**2 arrays (PRIVATE).
+
+        These are the terms summed by mean and std, with zeros for the
+        letters they skip.
+        """
+        logodds = self._array
+        background = np.array([background[letter] for letter in self.alphabet])
+        skip = np.isnan(logodds) | (logodds == -math.inf)
+        logodds = np.where(skip, 0.0, logodds)
+        p = background * np.power(2, logodds)
+        sx = np.where(skip, 0.0, p * logodds)
+        return sx, sx * logodds
+
     def std(self, background=None):
         """Return standard deviation of the score of a motif."""
         if background is None:
@@ -545,6 +707,12 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         total = sum(background.values())
         for letter in self.alphabet:
             background[letter] /= total
+        if self._array is not None:
+            sx, sxx = self._terms(background)
+            sx = sx.sum(axis=1)
+            variance = (sxx.sum(axis=1) - sx * sx).sum()
+            variance = max(variance, 0)  # to avoid roundoff problems
+            return math.sqrt(variance)
         variance = 0.0
         for i in range(self.length):
             sx = 0.0
@@ -621,3 +789,203 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         for letter in self.alphabet:
             background[letter] /= total
         return ScoreDistribution(precision=precision, pssm=self, background=background)
+
+
+def _search_chunk(pssm, rc, threshold, seq_len, subseq, chunk_start):
+    """Score one chunk for PositionSpecificScoringMatrix.search (PRIVATE)."""
+    pos_scores = pssm.calculate(subseq)
+    pos_ind = pos_scores >= threshold
+    pos_positions = np.where(pos_ind)[0] + chunk_start
+    pos_scores = pos_scores[pos_ind]
+    if rc is not None:
+        neg_scores = rc.calculate(subseq)
+        neg_ind = neg_scores >= threshold
+        neg_positions = np.where(neg_ind)[0] + chunk_start
+        neg_scores = neg_scores[neg_ind]
+    else:
+        neg_positions = np.empty((0), dtype=int)
+        neg_scores = np.empty((0), dtype=int)
+    chunk_positions = np.append(pos_positions, neg_positions - seq_len)
+    chunk_scores = np.append(pos_scores, neg_scores)
+    order = np.argsort(np.append(pos_positions, neg_positions))
+    return chunk_positions[order], chunk_scores[order]
+
+
+def _batch_chunk(
+    table,
+    lengths,
+    thresholds,
+    motif_ids,
+    negative,
+    seq_len,
+    chunksize,
+    chunk,
+    chunk_start,
+):
+    """Score one chunk for batch_search (PRIVATE)."""
+    codes = _CODES[_as_array(chunk)]
+    motif_l, _, columns = table.shape
+    # Windows starting in the chunk, past which it only holds the overlap
+    stop = min(chunksize, len(codes) - lengths.min() + 1)
+    # Score the chunk in blocks of rows small enough to stay in cache
+    block = max(1, 2**16 // columns)
+    hits = []
+    for block_start in range(0, stop, block):
+        rows = min(block, stop - block_start)
+        window = codes[block_start : block_start + rows + motif_l - 1]
+        padded = np.full(rows + motif_l - 1, 5, np.uint8)
+        padded[: len(window)] = window
+        # Sum in the same order, and to the same precision, as calculate
+        scores = np.zeros((rows, columns))
+        for j in range(motif_l):
+            scores += table[j][padded[j : j + rows]]
+        scores = scores.astype(np.float32)
+        scores[np.arange(rows)[:, None] + lengths > len(window)] = np.nan
+        # Row-major order gives hits sorted by start, then by column
+        starts, cols = np.nonzero(scores >= thresholds)
+        positions = starts + chunk_start + block_start
+        positions[negative[cols]] -= seq_len
+        hits.append((motif_ids[cols], positions, scores[starts, cols]))
+    if not hits:
+        return np.empty(0, int), np.empty(0, int), np.empty(0, np.float32)
+    return tuple(np.concatenate(column) for column in zip(*hits))
+
+
+# Scoring function and memory-mapped sequence of a worker process, see
+# _init_worker
+_worker = None
+
+
+def _init_worker(scan, path, offset, length):
+    global _worker
+    _worker = scan, np.memmap(path, np.uint8, "r", offset, (length,))
+
+
+def _file_region(sequence):
+    """Return the file name and offset of a memory-mapped sequence (PRIVATE).
+
+    Only a numpy memmap mapping the file directly qualifies, so that the
+    bytes of the file are those of the sequence; None is returned for
+    anything else.
+    """
+    if (
+        isinstance(sequence, np.memmap)
+        and isinstance(sequence.base, mmap.mmap)
+        and sequence.filename is not None
+        and sequence.mode != "c"
+        and sequence.ndim == 1
+        and sequence.itemsize == 1
+    ):
+        return sequence.filename, sequence.offset
+    return None
+
+
+def _scan_shared(chunk_start, chunk_end):
+    scan, sequence = _worker
+    return scan(sequence[chunk_start:chunk_end], chunk_start)
+
+
+def _scan_chunks(scan, sequence, chunksize, overlap, workers=1):
+    """Yield the hits of scan over the sequence, chunk by chunk (PRIVATE).
+
+    scan is called as scan(subseq, chunk_start) on each chunk, extended by
+    overlap letters so that windows starting in it are complete, and
+    returns a tuple of arrays that are zipped into hits. With more than
+    one worker, the worker processes memory-map the sequence, so each job
+    only carries its offsets. A numpy memmap of a file is mapped from that
+    file; any other sequence is first written to a temporary file. Chunks
+    are done in order either way. The sequence is only ever sliced, so no
+    more than a chunk of it is copied at once.
+    """
+    seq_len = len(sequence)
+    chunk_starts = range(0, seq_len, chunksize)
+    chunk_ends = [chunk_start + chunksize + overlap for chunk_start in chunk_starts]
+    if workers <= 1 or not seq_len:
+        for chunk_start, chunk_end in zip(chunk_starts, chunk_ends):
+            yield from zip(*scan(sequence[chunk_start:chunk_end], chunk_start))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        region = _file_region(sequence)
+        if region is None:
+            region = os.path.join(directory, "sequence"), 0
+            with open(region[0], "wb") as handle:
+                for chunk_start in chunk_starts:
+                    chunk = sequence[chunk_start : chunk_start + chunksize]
+                    handle.write(_as_array(chunk))
+        executor = ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(scan, *region, seq_len)
+        )
+        try:
+            for hits in executor.map(_scan_shared, chunk_starts, chunk_ends):
+                yield from zip(*hits)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+
+def batch_search(
+    pssms, sequence, threshold=0.0, both=True, chunksize=10**6, workers=1
+):
+    """Find hits of several PSSMs in one pass over the sequence.
+
+    A generator function, equivalent to calling ``search`` on each PSSM
+    in turn, but the sequence is encoded only once and each chunk is
+    scored against all motifs and both strands together. Returns
+    (index, position, score) tuples, where index is the position of the
+    motif in pssms, and position and score are as given by ``search``.
+    Hits come in order of their start on the sequence, then of the motif
+    index, with the positive strand first. As with ``search``, the sequence
+    may be any buffer, such as a memory-mapped file, and is read a chunk at
+    a time.
+
+    The threshold is either one value for all motifs, or one per motif.
+    Chunks are scored a few rows at a time into a table of one score per
+    motif, strand, and position, kept at about 65536 scores so that it
+    stays in the processor cache.
+
+    With more than one worker, the chunks are scored in a pool of that
+    many processes. The workers memory-map the sequence rather than having
+    it pickled for each of them: a numpy memmap is mapped from its own
+    file, and any other sequence is written once to a temporary file. Hits
+    are yielded in the same order as with a single worker.
+    """
+    pssms = list(pssms)
+    for pssm in pssms:
+        if sorted(pssm.alphabet) != ["A", "C", "G", "T"]:
+            raise ValueError(
+                "PSSM has wrong alphabet: %s - Use only with DNA motifs" % pssm.alphabet
+            )
+    if not pssms:
+        return
+    strands = [[pssm, pssm.reverse_complement()] if both else [pssm] for pssm in pssms]
+    # One column per motif and strand, in the order hits are reported
+    columns = [matrix for pair in strands for matrix in pair]
+    lengths = np.array([matrix.length for matrix in columns])
+    motif_l = lengths.max()
+    # table[j, c, k] is the score of letter c at position j of column k.
+    # Letter 4 is anything but ACGT, letter 5 pads the sequence end; the
+    # padding is never scored, as windows running past the end are masked.
+    table = np.zeros((motif_l, 6, len(columns)))
+    for k, matrix in enumerate(columns):
+        for j in range(matrix.length):
+            table[j, :4, k] = [matrix[letter][j] for letter in "ACGT"]
+            table[j, 4, k] = math.nan
+    thresholds = np.repeat(
+        np.broadcast_to(np.asarray(threshold, np.float32), len(pssms)), len(strands[0])
+    )
+    motif_ids = np.repeat(np.arange(len(pssms)), len(strands[0]))
+    negative = np.tile(np.arange(len(strands[0])) == 1, len(pssms))
+
+    scan = functools.partial(
+        _batch_chunk,
+        table,
+        lengths,
+        thresholds,
+        motif_ids,
+        negative,
+        len(sequence),
+        chunksize,
+    )
+    for motif_id, position, score in _scan_chunks(
+        scan, sequence, chunksize, motif_l - 1, workers
+    ):
+        yield int(motif_id), position, score
@@ -8,7 +8,11 @@
 
 """Tests for motifs module."""
 
+import copy
 import math
+import mmap
+import os
+import pickle
 import tempfile
 import unittest
 
@@ -22,6 +26,8 @@ except ImportError:
     ) from None
 
 from Bio import motifs
+from Bio.motifs.matrix import batch_search
+from Bio.motifs.matrix import FrequencyPositionMatrix
 from Bio.Seq import Seq
 
 
@@ -5157,6 +5163,287 @@ class MotifTestPWM(unittest.TestCase):
         self.assertAlmostEqual(pseudocounts["T"], 1.695582495781317, places=5)
 
 
+class MotifTestMatrixStorage(unittest.TestCase):
+    """Tests of position matrices stored as one array."""
+
+    with open("motifs/SRF.pfm") as stream:
+        m = motifs.read(stream, "pfm")
+
+    def assertMatrixAlmostEqual(self, matrix1, matrix2):
+        self.assertEqual(matrix1.alphabet, matrix2.alphabet)
+        self.assertEqual(matrix1.length, matrix2.length)
+        for letter in matrix1.alphabet:
+            for value1, value2 in zip(matrix1[letter], matrix2[letter]):
+                self.assertAlmostEqual(value1, value2, places=10)
+
+    def test_array_storage(self):
+        """Test that array storage gives the same results as dict storage."""
+        counts = self.m.counts
+        values = np.column_stack([counts[letter] for letter in "ACGT"])
+        array_counts = FrequencyPositionMatrix("ACGT", values)
+        self.assertEqual(array_counts["G", 2], counts["G", 2])
+        self.assertEqual(tuple(array_counts["T"]), tuple(counts["T"]))
+        self.assertEqual(str(array_counts), str(counts))
+        self.assertEqual(array_counts.consensus, counts.consensus)
+        self.assertEqual(array_counts.anticonsensus, counts.anticonsensus)
+        self.assertEqual(array_counts.degenerate_consensus, counts.degenerate_consensus)
+        self.assertAlmostEqual(array_counts.gc_content, counts.gc_content)
+        self.assertMatrixAlmostEqual(
+            array_counts.reverse_complement(), counts.reverse_complement()
+        )
+        self.assertEqual(array_counts[:, 2:8], counts[:, 2:8])
+        for pseudocounts in (None, 0.5, {"A": 0.1, "C": 0.2, "G": 0.3, "T": 0.4}):
+            pwm = counts.normalize(pseudocounts)
+            array_pwm = array_counts.normalize(pseudocounts)
+            self.assertMatrixAlmostEqual(array_pwm, pwm)
+            background = {"A": 0.3, "C": 0.2, "G": 0.2, "T": 0.3}
+            pssm = pwm.log_odds(background)
+            array_pssm = array_pwm.log_odds(background)
+            self.assertMatrixAlmostEqual(array_pssm, pssm)
+            self.assertEqual(array_pssm.consensus, pssm.consensus)
+            self.assertAlmostEqual(array_pssm.max, pssm.max)
+            self.assertAlmostEqual(array_pssm.min, pssm.min)
+            self.assertAlmostEqual(array_pssm.mean(background), pssm.mean(background))
+            self.assertAlmostEqual(array_pssm.std(background), pssm.std(background))
+            sequence = "ACGTGTGCGTAGTGCGTNCCATATAAGG"
+            self.assertTrue(
+                np.array_equal(
+                    array_pssm.calculate(sequence),
+                    pssm.calculate(sequence),
+                    equal_nan=True,
+                )
+            )
+
+    def test_setitem(self):
+        """Test that setting the values of a letter updates the array."""
+        values = np.column_stack([self.m.counts[letter] for letter in "ACGT"])
+        counts = FrequencyPositionMatrix("ACGT", values)
+        counts["A"] = [100.0] * counts.length
+        self.assertEqual(counts["A", 0], 100.0)
+        self.assertEqual(counts.consensus, "A" * counts.length)
+
+    def test_copy_and_pickle(self):
+        """Test copying and pickling matrices in array storage."""
+        values = np.column_stack([self.m.counts[letter] for letter in "ACGT"])
+        counts = FrequencyPositionMatrix("ACGT", values)
+        pssm = counts.normalize(0.5).log_odds()
+        for matrix in (counts, pssm):
+            copies = [copy.copy(matrix), copy.deepcopy(matrix)]
+            copies += [
+                pickle.loads(pickle.dumps(matrix, protocol))
+                for protocol in range(pickle.HIGHEST_PROTOCOL + 1)
+            ]
+            for other in copies:
+                self.assertIs(type(other), type(matrix))
+                self.assertEqual(other.length, matrix.length)
+                self.assertEqual(other, matrix)
+                self.assertEqual(str(other), str(matrix))
+                for letter in "ACGT":
+                    self.assertTrue(np.shares_memory(other[letter], other._array))
+                other["A"] = [100.0] * other.length
+                self.assertEqual(other["A", 0], 100.0)
+                self.assertEqual(other.consensus, "A" * other.length)
+                self.assertNotEqual(other, matrix)
+            self.assertNotEqual(matrix["A", 0], 100.0)
+        # dict storage
+        other = pickle.loads(pickle.dumps(self.m.counts))
+        self.assertEqual(other, self.m.counts)
+        self.assertEqual(copy.deepcopy(self.m.counts), self.m.counts)
+
+    def test_equality(self):
+        """Test comparing matrices in array and dict storage."""
+        values = np.column_stack([self.m.counts[letter] for letter in "ACGT"])
+        counts = FrequencyPositionMatrix("ACGT", values)
+        self.assertEqual(counts, self.m.counts)
+        self.assertEqual(self.m.counts, counts)
+        self.assertEqual(counts, counts.reverse_complement().reverse_complement())
+        # matrices with NaN values
+        pssm = counts.normalize().log_odds({"A": 0.5, "C": 0.0, "G": 0.0, "T": 0.5})
+        self.assertEqual(pssm, pssm.reverse_complement().reverse_complement())
+        self.assertNotEqual(counts, counts.reverse_complement())
+        self.assertNotEqual(counts, counts[:, 1:])
+
+    def test_nan_scores(self):
+        """Test the score range of a PSSM with NaN scores."""
+        m = motifs.create([Seq("ACGTA"), Seq("ACGTT"), Seq("ACCTA")])
+        background = {"A": 0.5, "C": 0.0, "G": 0.0, "T": 0.5}
+        values = np.column_stack([m.counts[letter] for letter in "ACGT"])
+        counts = FrequencyPositionMatrix("ACGT", values)
+        pssm = m.counts.normalize().log_odds(background)
+        array_pssm = counts.normalize().log_odds(background)
+        self.assertTrue(np.isnan(array_pssm._array).any())
+        self.assertEqual(pssm.max, math.inf)
+        self.assertEqual(pssm.min, -math.inf)
+        self.assertEqual(array_pssm.max, pssm.max)
+        self.assertEqual(array_pssm.min, pssm.min)
+        m.background = background
+        self.assertEqual(m.pssm.max, math.inf)
+        self.assertEqual(m.pssm.min, -math.inf)
+
+    def test_cache(self):
+        """Test that the pwm and pssm follow changes to the motif."""
+        m = motifs.create([Seq("ACGTG"), Seq("ACGTC"), Seq("TCGAG")])
+
+        def check():
+            pwm = m.counts.normalize(m.pseudocounts)
+            self.assertMatrixAlmostEqual(m.pwm, pwm)
+            self.assertMatrixAlmostEqual(m.pssm, pwm.log_odds(m.background))
+
+        check()
+        m.pseudocounts = 0.5
+        check()
+        m.pseudocounts["C"] = 2.0
+        check()
+        m.background = 0.6
+        check()
+        m.background["A"] = 0.5
+        check()
+        m.counts["G"][4] += 3
+        check()
+        m.counts["T"] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        check()
+
+    def test_cache_read_only(self):
+        """Test that the cached pwm and pssm cannot be changed in place."""
+        m = motifs.create([Seq("ACGTG"), Seq("ACGTC"), Seq("TCGAG")])
+        value = m.pssm["A"][0]
+        maximum = m.pssm.max
+        with self.assertRaises(ValueError):
+            m.pssm["A"][0] = 100.0
+        with self.assertRaises(ValueError):
+            m.pssm["A"] = [100.0] * 5
+        with self.assertRaises(ValueError):
+            m.pwm["A"][0] = 1.0
+        self.assertEqual(m.pssm["A"][0], value)
+        self.assertEqual(m.pssm.max, maximum)
+        pssm = copy.copy(m.pssm)
+        pssm["A"][0] = 100.0
+        self.assertEqual(pssm["A"][0], 100.0)
+        self.assertEqual(m.pssm["A"][0], value)
+
+    def test_cache_types(self):
+        """Test that the cached pwm and pssm hold read-only array columns."""
+        m = motifs.create([Seq("ACGTG"), Seq("ACGTC"), Seq("TCGAG")])
+        self.assertIsInstance(m.counts["A"], list)
+        for matrix in (m.pwm, m.pssm):
+            self.assertEqual(matrix._array.shape, (5, 4))
+            for letter in "ACGT":
+                self.assertIsInstance(matrix[letter], np.ndarray)
+                self.assertFalse(matrix[letter].flags.writeable)
+                self.assertTrue(np.shares_memory(matrix[letter], matrix._array))
+        # the columns are arrays, not the tuples and lists of normalize and
+        # log_odds, so they add and compare elementwise
+        pwm = m.counts.normalize(m.pseudocounts)
+        self.assertIsInstance(pwm["A"], tuple)
+        self.assertEqual(len(m.pwm["A"] + (1.0,)), 5)
+        self.assertTrue(np.array_equal(m.pwm["A"] == pwm["A"], [True] * 5))
+
+
+class MotifTestSearch(unittest.TestCase):
+    """Tests of PSSM search and batch_search."""
+
+    with open("motifs/SRF.pfm") as stream:
+        m1 = motifs.read(stream, "pfm")
+    m1.pseudocounts = 0.25
+    m2 = motifs.create([Seq("ACGTG"), Seq("ACGTC"), Seq("TCGTG"), Seq("ACCTG")])
+    m2.pseudocounts = 0.5
+    pssms = [m1.pssm, m2.pssm]
+
+    rng = np.random.default_rng(1)
+    s = "".join(rng.choice(list("ACGT"), 2500))
+    # an ambiguous base, and lower case letters near the end
+    s = s[:1200] + "N" + s[1201:2300] + s[2300:].lower()
+
+    def sorted_hits(self, pssms, sequence, thresholds, both=True):
+        """Return the search hits of each PSSM in batch_search order."""
+        hits = []
+        for index, (pssm, threshold) in enumerate(zip(pssms, thresholds)):
+            for position, score in pssm.search(
+                sequence, threshold, both, chunksize=600
+            ):
+                hits.append((index, position, score))
+        n = len(sequence)
+        return sorted(hits, key=lambda hit: (hit[1] % n, hit[0], hit[1] < 0))
+
+    def test_batch_search(self):
+        """Test that batch_search gives the hits of search on each PSSM."""
+        expected = self.sorted_hits(self.pssms, self.s, [-8.0, -8.0])
+        self.assertGreater(len(expected), 10)
+        self.assertTrue(any(position < 0 for _, position, _ in expected))
+        hits = list(batch_search(self.pssms, self.s, -8.0, chunksize=600))
+        self.assertEqual(hits, expected)
+
+    def test_batch_search_thresholds(self):
+        """Test batch_search with one threshold per PSSM."""
+        expected = self.sorted_hits(self.pssms, self.s, [-2.0, -6.0])
+        hits = list(batch_search(self.pssms, self.s, [-2.0, -6.0], chunksize=600))
+        self.assertEqual(hits, expected)
+
+    def test_batch_search_one_strand(self):
+        """Test batch_search on the positive strand only."""
+        expected = self.sorted_hits(self.pssms, self.s, [-8.0, -8.0], both=False)
+        hits = list(batch_search(self.pssms, self.s, -8.0, both=False, chunksize=600))
+        self.assertEqual(hits, expected)
+        self.assertTrue(all(position >= 0 for _, position, _ in hits))
+
+    def test_workers(self):
+        """Test that searching in worker processes gives the same hits."""
+        pssm = self.pssms[1]
+        expected = list(pssm.search(self.s, -6.0, chunksize=600))
+        self.assertEqual(
+            list(pssm.search(self.s, -6.0, chunksize=600, workers=2)), expected
+        )
+        expected = list(batch_search(self.pssms, self.s, -8.0, chunksize=600))
+        hits = list(batch_search(self.pssms, self.s, -8.0, chunksize=600, workers=2))
+        self.assertEqual(hits, expected)
+
+    def test_workers_memmap(self):
+        """Test searching a memory-mapped FASTA sequence in worker processes."""
+        pssm = self.pssms[1]
+        expected = list(pssm.search(self.s, -6.0, chunksize=600))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sequence.fa")
+            with open(path, "w") as handle:
+                handle.write(">chr\n%s\n" % self.s)
+            memmap = np.memmap(path, np.uint8, "r", 5, (len(self.s),))
+            hits = list(pssm.search(memmap, -6.0, chunksize=600, workers=2))
+            self.assertEqual(hits, expected)
+            hits = list(
+                batch_search(self.pssms, memmap, -8.0, chunksize=600, workers=2)
+            )
+            self.assertEqual(hits, self.sorted_hits(self.pssms, self.s, [-8.0, -8.0]))
+            del memmap
+
+    def test_buffers(self):
+        """Test scoring bytes, bytearray, mmap, numpy memmap and lower case input."""
+        pssm = self.pssms[1]
+        expected = list(pssm.search(self.s, -6.0, chunksize=600))
+        scores = pssm.calculate(self.s)
+        data = self.s.encode()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sequence")
+            with open(path, "wb") as handle:
+                handle.write(data)
+            with open(path, "rb") as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            memmap = np.memmap(path, np.uint8, "r")
+            sequences = [data, bytearray(data), mapped, memmap, self.s.lower()]
+            for sequence in sequences:
+                msg = f"using {type(sequence).__name__}"
+                hits = list(pssm.search(sequence, -6.0, chunksize=600))
+                self.assertEqual(hits, expected, msg=msg)
+                self.assertTrue(
+                    np.array_equal(pssm.calculate(sequence), scores, equal_nan=True),
+                    msg=msg,
+                )
+                hits = list(batch_search(self.pssms, sequence, -8.0, chunksize=600))
+                self.assertEqual(
+                    hits, self.sorted_hits(self.pssms, self.s, [-8.0, -8.0]), msg=msg
+                )
+            del memmap
+            mapped.close()
+
+
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=2)
     unittest.main(testRunner=runner)